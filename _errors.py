@@ -18,3 +18,14 @@ class BadConfigTypeError(TypeError):
 class NonExistentItemError(Exception):
     def __init__(self, attr, value):
         super().__init__(f'There is no item with {attr}={value!r}')
+
+@public
+class RemoteError(Exception):
+    def __init__(self, type, message):
+        self.type = type
+        super().__init__(f'{type}: {message}')
+
+@public
+class NonExistentPlayerError(Exception):
+    def __init__(self, player, mode):
+        super().__init__(f'There is no player {player!r} on the {mode} hiscores')
@@ -0,0 +1,151 @@
+import heapq
+import operator
+from array import array
+from itertools import compress
+
+from publicize import public
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NATURE_RUNE = 561
+
+def _column(values):
+    if np is not None:
+        return np.asarray(values, dtype='q')
+    return array('q', values)
+
+def _apply(op, a, b):
+    """op over two columns (or a column and a number) elementwise"""
+    if np is not None:
+        return op(a, b)
+    if isinstance(b, array):
+        return array('q', map(op, a, b))
+    return array('q', [op(x, b) for x in a])
+
+@public
+class ItemArrays:
+    """Columns of `fields` for a group of items, as numpy int64 arrays
+    when numpy is installed (array('q') otherwise).
+
+    Unknown prices are 0, and so are left out of the price based
+    rankings. `nature_rune` is the price of the nature rune casting
+    high alchemy costs.
+    """
+
+    fields = ('id', 'alch', 'membs', 'ge_price', 'osb_price')
+
+    def __init__(self, id, alch, membs, ge_price, osb_price, nature_rune=0):
+        self.id = _column(id)
+        self.alch = _column(alch)
+        self.membs = _column(membs)
+        self.ge_price = _column(ge_price)
+        self.osb_price = _column(osb_price)
+        self.nature_rune = nature_rune
+
+    def __len__(self):
+        return len(self.id)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} object with {len(self)} items at 0x{id(self):08X}>'
+
+    def __getitem__(self, key):
+        """A column by name, or the rows picked by a mask or indices"""
+        if isinstance(key, str):
+            if key not in self.fields:
+                error = KeyError(key)
+                raise error
+            return getattr(self, key)
+        return self.take(key)
+
+    def take(self, rows):
+        """The rows of a boolean mask or a sequence of row numbers"""
+        if np is not None:
+            rows = np.asarray(rows)
+            if rows.dtype != bool:
+                rows = rows.astype(np.intp)
+            columns = [getattr(self, f)[rows] for f in self.fields]
+        else:
+            rows = [*rows]
+            if rows and all(map(bool.__instancecheck__, rows)):
+                columns = [compress(getattr(self, f), rows)
+                           for f in self.fields]
+            else:
+                columns = [map(getattr(self, f).__getitem__, rows)
+                           for f in self.fields]
+        return self.__class__(*columns, nature_rune=self.nature_rune)
+
+    def where(self, predicate):
+        """The rows for which predicate(row) is true, a row being a dict
+        of the fields. Pass a mask to `take` to stay vectorized."""
+        rows = zip(*map(self.__getattribute__, self.fields))
+        return self.take([bool(predicate(dict(zip(self.fields, row))))
+                          for row in rows])
+
+    def price(self, source='best'):
+        """Prices from 'ge', 'osb' or the 'best' of the two (OSB when it
+        is known, like Item.get_best_price)"""
+        if source == 'ge':
+            return self.ge_price
+        if source == 'osb':
+            return self.osb_price
+        if source != 'best':
+            error = ValueError(f"source must be 'ge', 'osb' or 'best', not {source!r}")
+            raise error
+        if np is not None:
+            return np.where(self.osb_price > 0, self.osb_price, self.ge_price)
+        return array('q', [o or g for o, g in zip(self.osb_price, self.ge_price)])
+
+    def margin(self):
+        """OSB price - GE price"""
+        return _apply(operator.sub, self.osb_price, self.ge_price)
+
+    def alch_profit(self, source='best'):
+        """High alchemy value - price - nature rune price"""
+        profit = _apply(operator.sub, self.alch, self.price(source))
+        return _apply(operator.sub, profit, self.nature_rune)
+
+    def top(self, values, k=10, mask=None):
+        """The (at most) `k` rows with the largest `values`, largest
+        first, among the rows where `mask` is true"""
+        if np is not None:
+            values = np.asarray(values)
+            rows = np.arange(len(values))
+            if mask is not None:
+                rows = rows[np.asarray(mask, dtype=bool)]
+            if k < len(rows):
+                rows = rows[np.argpartition(-values[rows], k)[:k]]
+            rows = rows[np.argsort(-values[rows], kind='stable')]
+        else:
+            rows = range(len(values))
+            if mask is not None:
+                rows = compress(rows, mask)
+            rows = heapq.nlargest(k, rows, key=values.__getitem__)
+        return self.take(rows)
+
+    def best_alchs(self, k=10, source='best'):
+        """The `k` items making the most from high alchemy at their
+        `source` price, skipping the ones without one"""
+        price = self.price(source)
+        mask = (price > 0 if np is not None
+                else [p > 0 for p in price])
+        return self.top(self.alch_profit(source), k, mask)
+
+    def best_margins(self, k=10):
+        """The `k` items with the largest OSB - GE price margin, among
+        those with both"""
+        if np is not None:
+            mask = (self.ge_price > 0) & (self.osb_price > 0)
+        else:
+            mask = [g > 0 and o > 0 for g, o in zip(self.ge_price, self.osb_price)]
+        return self.top(self.margin(), k, mask)
+
+    def to_dict(self):
+        return {f:getattr(self, f) for f in self.fields}
+
+    def to_frame(self):
+        """pandas DataFrame of the columns, indexed by id"""
+        import pandas
+        return pandas.DataFrame(
+            {f:getattr(self, f) for f in self.fields}).set_index('id')
@@ -0,0 +1,164 @@
+"""Client of the price service run by `python -m ohseven.serve`
+
+It does not import the items module until it has results to return,
+so consumers can talk to the service without loading the item database.
+"""
+import http.client
+import json
+import threading
+
+from publicize import public
+
+try:
+    from ._errors import RemoteError
+    from .utils import DotDict, isexceptioninstance
+except ImportError:
+    from _errors import RemoteError
+    from utils import DotDict, isexceptioninstance
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8707
+
+def _remote_error(response):
+    error = response['error']
+    return RemoteError(error['type'], error['message'])
+
+def _items():
+    # imported on first use, so that importing the client loads nothing
+    try:
+        from . import items
+    except ImportError:
+        import items
+    return items
+
+def _to_item(record):
+    return None if record is None else _items().Item(**record)
+
+def _to_itemset(records):
+    return _items().ItemSet._from_itemset([*map(_to_item, records)])
+
+def _to_prices(info_class):
+    def decode(results):
+        info = getattr(_items(), info_class)
+        return DotDict({int(id):_remote_error(value) if 'error' in value
+                        else info(**value)
+                        for id, value in results.items()})
+    return decode
+
+_DECODERS = {
+    'get': _to_item,
+    'get_by_name': _to_item,
+    'search': _to_itemset,
+    'search_many': lambda results: [*map(_to_itemset, results)],
+    'complete': _to_itemset,
+    'ge_lookup': _to_prices('ge_info'),
+    'osb_lookup': _to_prices('osb_info'),
+    }
+
+@public
+class Client:
+    """The items API of a `serve` process. Each thread keeps its own
+    connection to it alive between calls.
+
+    Results are the Items, ItemSets and price infos of the items module,
+    which is imported with the first of them. Set load_items_on_import
+    to false in the config of client processes so that this does not
+    load the item database and caches the service already holds. The
+    price methods of those Items look prices up locally, so use the
+    client's ge_lookup and osb_lookup instead.
+
+    A call that fails in the server raises RemoteError, except for the
+    prices of single items, which are RemoteErrors in the result like
+    the exceptions items.ge_lookup returns.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, *, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def _post(self, body):
+        data = json.dumps(body).encode()
+        headers = {'Content-Type': 'application/json'}
+        connection = self._connection()
+        # the server may have closed a connection kept alive too long
+        for retry in (True, False):
+            try:
+                connection.request('POST', '/rpc', data, headers)
+                response = connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                connection.close()
+                if not retry:
+                    raise
+        if response.status != 200:
+            error = RemoteError('HTTPError', f'{response.status} {response.reason}')
+            raise error
+        return json.loads(payload)
+
+    @staticmethod
+    def _result(method, response):
+        if 'error' in response:
+            return _remote_error(response)
+        decode = _DECODERS.get(method)
+        result = response['result']
+        return decode(result) if decode else result
+
+    def call(self, method, *params, **kwargs):
+        result = self._result(method, self._post(
+            {'method': method, 'params': params, 'kwargs': kwargs}))
+        if isexceptioninstance(result):
+            raise result
+        return result
+
+    def batch(self, calls):
+        """Results of (method, params[, kwargs]) `calls` made in one
+        request, with a RemoteError in place of any that failed"""
+        calls = [(method, params, *kwargs) for method, params, *kwargs in calls]
+        responses = self._post([{'method': method, 'params': params,
+                                 'kwargs': kwargs[0] if kwargs else {}}
+                                for method, params, *kwargs in calls])
+        return [self._result(call[0], response)
+                for call, response in zip(calls, responses)]
+
+    def get(self, id, default=None):
+        item = self.call('get', id)
+        return default if item is None else item
+
+    def get_by_name(self, name, default=None):
+        item = self.call('get_by_name', name)
+        return default if item is None else item
+
+    def search(self, *params, fuzzy=False, limit=5):
+        return self.call('search', *params, fuzzy=fuzzy, limit=limit)
+
+    def search_many(self, queries):
+        return self.call('search_many', [*queries])
+
+    def complete(self, prefix, limit=10):
+        return self.call('complete', prefix, limit)
+
+    def ge_lookup(self, *ids):
+        return self.call('ge_lookup', *map(int, ids))
+
+    def osb_lookup(self, *ids):
+        return self.call('osb_lookup', *map(int, ids))
+
+    def cache_info(self):
+        return self.call('cache_info')
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -1,19 +1,19 @@
 from pathlib import Path
 import json
-import requests
 import warnings
 from functools import lru_cache
 
 from publicize import public, public_constants
 try:
-    from utils import DotDict, backup_file
+    from utils import DotDict, Transport, backup_file
     from _errors import MissingConfigOptionsError, BadConfigTypeError
 except:
-    from .utils import DotDict, backup_file
+    from .utils import DotDict, Transport, backup_file
     from ._errors import MissingConfigOptionsError, BadConfigTypeError
 public_constants(
     PATH=Path.home()/'.ohseven.data',
     CONFIG=DotDict(),
+    TRANSPORT=Transport(),# every download goes through this
     )
 
 RAW_ITEM_DATA_URL = 'https://pastebin.com/raw/Hqz7yde3'
@@ -69,11 +69,11 @@ def save_config(path_override=None, backup_path=None):
             
 @lru_cache(None)
 def default_item_data():
-    return requests.get(RAW_ITEM_DATA_URL).json()
+    return TRANSPORT.get_json(RAW_ITEM_DATA_URL)
 
 @lru_cache(None)
 def download_search_parameters():
-    return requests.get(SEARCH_PARAMETER_URL).json() # abbv, ngrams, slang
+    return TRANSPORT.get_json(SEARCH_PARAMETER_URL) # abbv, ngrams, slang
 
 @public
 def load_config():
@@ -114,6 +114,14 @@ def load_config():
         raise error
     for k, v in CONFIG.copy().items():
         CONFIG[k] = DotDict(v)
+
+@public
+def ensure_data_files():
+    """Download the item database and search files that are missing
+
+    This may block on the network, so it is left to the first
+    `items.load()` rather than done when the config is loaded.
+    """
     if (PATH/CONFIG.filenames.item_data).exists():
         with open(PATH/CONFIG.filenames.item_data) as fp:
             data = fp.read()
@@ -0,0 +1,193 @@
+import asyncio
+from array import array
+from collections import namedtuple
+from concurrent.futures import wait
+from urllib.parse import quote
+
+from publicize import public
+
+if __name__ == '__main__':
+    from config import CONFIG, TRANSPORT
+    from items import PriceCache, _Flights
+    from utils import *
+    from _errors import NonExistentPlayerError
+else:
+    from .config import CONFIG, TRANSPORT
+    from .items import PriceCache, _Flights
+    from .utils import *
+    from ._errors import NonExistentPlayerError
+
+# in the order the hiscores list them
+SKILLS = ('overall', 'attack', 'defence', 'strength', 'hitpoints', 'ranged',
+          'prayer', 'magic', 'cooking', 'woodcutting', 'fletching',
+          'fishing', 'firemaking', 'crafting', 'smithing', 'mining',
+          'herblore', 'agility', 'thieving', 'slayer', 'farming',
+          'runecrafting', 'hunter', 'construction', 'sailing')
+
+SkillStats = namedtuple('SkillStats', ('rank', 'level', 'xp'))
+ActivityStats = namedtuple('ActivityStats', ('rank', 'score'))
+
+def normalize_player(name):
+    """The hiscores treat case, spaces, underscores and hyphens in names
+    as the same"""
+    return ' '.join(name.replace('_', ' ').replace('-', ' ').lower().split())
+
+@public
+class Hiscore:
+    """One player's hiscores in one mode, fetched at `time`
+
+    `skills` holds the rank, level and xp of every skill in SKILLS
+    order, and `activities` the rank and score of every activity and
+    boss, in one array each. Unranked entries are -1.
+    """
+
+    __slots__ = ('player', 'mode', 'time', 'skills', 'activities')
+
+    def __init__(self, player, mode, time, skills=(), activities=()):
+        self.player = player
+        self.mode = mode
+        self.time = time
+        self.skills = array('q', skills)
+        self.activities = array('q', activities)
+
+    @classmethod
+    def parse(cls, player, mode, text, time):
+        """Hiscore of an index_lite response"""
+        self = cls(player, mode, time)
+        for line in text.split():
+            values = [*map(int, line.split(','))]
+            if len(values) == 3:
+                self.skills.extend(values)
+            elif len(values) == 2:
+                self.activities.extend(values)
+            else:
+                error = ValueError(f'unexpected hiscores line {line!r}')
+                raise error
+        return self
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} of {self.player!r} ({self.mode})>'
+
+    def __getitem__(self, skill):
+        return self.skill(skill)
+
+    def skill(self, skill):
+        """SkillStats of a skill, by name or SKILLS index"""
+        i = skill if isintinstance(skill) else None
+        if i is None and skill.lower() in SKILLS:
+            i = SKILLS.index(skill.lower())
+        if i is None or not 0 <= 3*i < len(self.skills):
+            error = KeyError(skill)
+            raise error
+        return SkillStats(*self.skills[3*i:3*i+3])
+
+    def activity(self, i):
+        """ActivityStats of the `i`th activity"""
+        if not 0 <= 2*i < len(self.activities):
+            error = IndexError(i)
+            raise error
+        return ActivityStats(*self.activities[2*i:2*i+2])
+
+    def as_dict(self):
+        """{skill: SkillStats} of every skill"""
+        return DotDict(zip(SKILLS, map(self.skill, range(len(self.skills)//3))))
+
+    @property
+    def total_level(self):
+        return self.skill('overall').level
+
+    @property
+    def total_xp(self):
+        return self.skill('overall').xp
+
+    @property
+    def delta(self):
+        return time_in_seconds() - self.time
+
+@public
+class HiscoreInterface(_Flights):
+    """Player lookups on the hiscores of every mode in
+    CONFIG.hiscore_urls (apart from cml, which is a different API)
+
+    Results are cached for `ttl` seconds, and served stale for as long
+    again while they are looked up in the background. At most
+    `max_concurrency` requests are made at once, and they share the
+    rate limit of the host with the GE price lookups.
+    """
+
+    def __init__(self, ttl=3600, *, maxsize=10000, priority=0):
+        # never written out, so there's no need to track what changed
+        self.cache = PriceCache(ttl, stale_ttl=ttl, min_ttl=0, maxsize=maxsize,
+                                track_changes=False)
+        self.priority = priority
+        self._init_flights()
+
+    @property
+    def modes(self):
+        return [mode for mode, url in CONFIG.hiscore_urls.items() if '%s' in url]
+
+    def _key(self, player, mode):
+        if mode not in self.modes:
+            error = ValueError(f'no hiscores for mode {mode!r}')
+            raise error
+        return normalize_player(player), mode
+
+    def _lookup(self, key):
+        player, mode = key
+        try:
+            response = TRANSPORT.get(CONFIG.hiscore_urls[mode] % quote(player),
+                                     priority=self.priority)
+            if response.status_code == 404:
+                return key, NonExistentPlayerError(player, mode)
+            response.raise_for_status()
+            return key, Hiscore.parse(player, mode, response.text,
+                                      time_in_seconds())
+        except Exception as error:
+            return key, error
+
+    def _fetch(self, key):
+        """(key, Hiscore or exception) of one uncached lookup, caching
+        the Hiscore"""
+        key, result = self._lookup(key)
+        if not isexceptioninstance(result):
+            self.cache[key] = result
+        return key, result
+
+    def lookup_all(self, players, modes=None):
+        """{(player, mode): Hiscore or exception} of each of `players` in
+        each of `modes` (every mode if None), looked up concurrently"""
+        keys = {(player, mode):self._key(player, mode)
+                for player in players for mode in modes or self.modes}
+        results = self._from_cache({*keys.values()})
+        futures = [self._start(key, self._fetch, key)
+                   for key in {*keys.values()} - results.keys()]
+        wait(futures)
+        results.update(future.result() for future in futures)
+        return DotDict({k:results[key] for k, key in keys.items()})
+
+    def lookup(self, *players, mode='normal'):
+        """{player: Hiscore or exception} of `players` in one mode"""
+        results = self.lookup_all(players, [mode])
+        return DotDict({player:results[player, mode] for player in players})
+
+    async def alookup_iter(self, *players, mode='normal'):
+        """Asynchronously yield (player, Hiscore or exception) pairs as
+        each one becomes available, cached ones first"""
+        keys = {self._key(player, mode):player for player in players}
+        cached = self._from_cache(keys)
+        for key, result in cached.items():
+            yield keys[key], result
+        futures = [self._submit(key, self._fetch, key)
+                   for key in keys.keys() - cached.keys()]
+        for future in asyncio.as_completed(futures):
+            key, result = await future
+            yield keys[key], result
+
+    async def alookup(self, *players, mode='normal'):
+        return DotDict([pair async for pair in self.alookup_iter(*players, mode=mode)])
+
+    def cache_info(self):
+        return self.cache.info()
+
+hiscores = HiscoreInterface()
+hiscore_lookup = hiscores.lookup
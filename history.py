@@ -0,0 +1,199 @@
+import math
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import closing
+from itertools import accumulate
+
+from publicize import public
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def _doubles(values):
+    """array('d') of a numpy array (or any iterable of numbers)"""
+    if np is not None and isinstance(values, np.ndarray):
+        result = array('d')
+        result.frombytes(values.astype('d').tobytes())
+        return result
+    return array('d', values)
+
+@public
+class PriceSeries:
+    """Prices of one item over time, as parallel arrays sorted by time
+
+    `times` are in seconds since the epoch. Moving averages and
+    volatility use numpy when it is installed and return array('d')
+    either way.
+    """
+
+    __slots__ = ('id', 'times', 'prices')
+
+    def __init__(self, id, times=(), prices=()):
+        self.id = id
+        self.times = array('q', times)
+        self.prices = array('q', prices)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return zip(self.times, self.prices)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} of item {self.id} with {len(self)} points>'
+
+    @property
+    def start(self):
+        return self.times[0] if self.times else None
+
+    @property
+    def end(self):
+        return self.times[-1] if self.times else None
+
+    def merge(self, points):
+        """Add (time, price) `points`, later ones replacing any already at
+        the same time. Returns the points that were new or changed."""
+        points = dict(points)
+        times, prices = self.times, self.prices
+        changed = {}
+        if times and min(points, default=times[-1]+1) > times[-1]:
+            # the usual case, everything's newer than what's here
+            for t in sorted(points):
+                times.append(t)
+                prices.append(points[t])
+            return points
+        merged = dict(zip(times, prices))
+        for t, price in points.items():
+            if merged.get(t) != price:
+                merged[t] = changed[t] = price
+        if changed:
+            order = sorted(merged)
+            self.times = array('q', order)
+            self.prices = array('q', map(merged.__getitem__, order))
+        return changed
+
+    def between(self, start=None, end=None):
+        """The points from `start` up to and including `end`"""
+        times = self.times
+        lo = 0 if start is None else bisect_left(times, start)
+        hi = len(times) if end is None else bisect_right(times, end)
+        return self.__class__(self.id, times[lo:hi], self.prices[lo:hi])
+
+    def resample(self, resolution):
+        """The mean price in each `resolution` second bucket that has any
+        points, timed at the start of the bucket"""
+        times = array('q')
+        prices = array('q')
+        bucket = None
+        for t, price in self:
+            b = t - t % resolution
+            if b != bucket:
+                if bucket is not None:
+                    times.append(bucket)
+                    prices.append(round(total/n))
+                bucket, total, n = b, 0, 0
+            total += price
+            n += 1
+        if bucket is not None:
+            times.append(bucket)
+            prices.append(round(total/n))
+        return self.__class__(self.id, times, prices)
+
+    def moving_average(self, window):
+        """Mean of each `window` consecutive prices (len - window + 1 of
+        them)"""
+        if not 0 < window <= len(self):
+            return array('d')
+        if np is not None:
+            sums = np.cumsum(np.frombuffer(self.prices, 'q'), dtype='d')
+            sums[window:] = sums[window:] - sums[:-window]
+            return _doubles(sums[window-1:] / window)
+        sums = [0, *accumulate(self.prices)]
+        return array('d', [(b-a)/window for a, b in zip(sums, sums[window:])])
+
+    def returns(self):
+        """Log returns between consecutive prices"""
+        prices = self.prices
+        if np is not None:
+            return _doubles(np.diff(np.log(np.frombuffer(prices, 'q'))))
+        log = math.log
+        return array('d', [log(b/a) for a, b in zip(prices, prices[1:])])
+
+    def volatility(self, window):
+        """Standard deviation of the log returns over each `window`
+        consecutive returns (len - window of them)"""
+        returns = self.returns()
+        if not 1 < window <= len(returns):
+            return array('d')
+        if np is not None:
+            r = np.frombuffer(returns, 'd')
+            sums = np.cumsum(np.concatenate(([0], r)))
+            squares = np.cumsum(np.concatenate(([0], r*r)))
+            total = sums[window:] - sums[:-window]
+            total_sq = squares[window:] - squares[:-window]
+            var = (total_sq - total*total/window) / (window-1)
+            return _doubles(np.sqrt(np.maximum(var, 0)))
+        sums = [0, *accumulate(returns)]
+        squares = [0, *accumulate(r*r for r in returns)]
+        sqrt = math.sqrt
+        result = array('d')
+        for a, b, a2, b2 in zip(sums, sums[window:], squares, squares[window:]):
+            total = b - a
+            var = (b2 - a2 - total*total/window) / (window-1)
+            result.append(sqrt(max(var, 0)))
+        return result
+
+@public
+class PriceHistory:
+    """Every price point ever downloaded, per item, kept in memory as
+    PriceSeries and merged into a local SQLite table as they arrive"""
+
+    def __init__(self, path):
+        self.path = path
+        self._series = {}
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('CREATE TABLE IF NOT EXISTS history '
+                   '(id INTEGER, time INTEGER, price INTEGER, '
+                   'PRIMARY KEY (id, time)) WITHOUT ROWID')
+        return db
+
+    def get(self, id):
+        """The PriceSeries of `id`, loaded from disk the first time"""
+        with self._lock:
+            series = self._series.get(id)
+            if series is None:
+                series = PriceSeries(id)
+                if self.path.exists():
+                    with closing(self._connect()) as db:
+                        rows = db.execute('SELECT time, price FROM history '
+                                          'WHERE id = ? ORDER BY time', (id,))
+                        for t, price in rows:
+                            series.times.append(t)
+                            series.prices.append(price)
+                self._series[id] = series
+            return series
+
+    def merge(self, id, points):
+        """Add (time, price) `points` of item `id`, writing only the ones
+        that are new"""
+        with self._lock:
+            changed = self.get(id).merge(points)
+            if changed:
+                with closing(self._connect()) as db, db:
+                    db.executemany('INSERT OR REPLACE INTO history '
+                                   'VALUES (?, ?, ?)',
+                                   [(id, t, p) for t, p in changed.items()])
+            return changed
+
+    def query(self, id, start=None, end=None, resolution=None):
+        with self._lock:
+            series = self.get(id).between(start, end)
+        if resolution:
+            series = series.resample(resolution)
+        return series
@@ -1,33 +1,55 @@
 
+import heapq
 import itertools
 import json
+import mmap
 import operator
+import os
+import pathlib
+import pickle
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import warnings
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import namedtuple
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from concurrent.futures import (Future, ThreadPoolExecutor, as_completed,
+                                wait, FIRST_COMPLETED)
+from contextlib import closing
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping, MutableMapping, ValuesView
 from types import MappingProxyType
+from urllib.parse import urlsplit
 
 import attr
-import requests
 
 from publicize import public, public_constants
 
 
 if __name__ == '__main__':
-    from config import CONFIG, PATH
-    from search_engine import search_setup
+    from config import CONFIG, PATH, TRANSPORT, ensure_data_files
+    from history import PriceHistory
+    from analytics import ItemArrays, NATURE_RUNE
+    from search_engine import search_setup, Completer
     from utils import *
     from _errors import NonExistentItemError
 else:
-    from .config import CONFIG, PATH
-    from .search_engine import search_setup
+    from .config import CONFIG, PATH, TRANSPORT, ensure_data_files
+    from .history import PriceHistory
+    from .analytics import ItemArrays, NATURE_RUNE
+    from .search_engine import search_setup, Completer
     from .utils import *
     from ._errors import NonExistentItemError
+SNAPSHOT_VERSION = 1
 OSB_IGNORE     = ['8534', '8536', '8538', '8540', '8542', '8544', '8546',
                   '8630', '8632', '8634', '8636', '8638', '8640', '8642',
                   '8644', '8646', '8648']
 
-@attr.s(hash=True)
+@attr.s(hash=True, slots=True)
 class Item:
     id=attr.ib(hash=True)
     name=attr.ib(hash=True)
@@ -42,6 +64,11 @@ class Item:
     def get_osb_info(self):
         return osb_lookup(self.id)[self.id]
     
+    def price_history(self, start=None, end=None, resolution=None):
+        """PriceSeries of the item's GE prices from `start` to `end`
+        (seconds since the epoch), averaged over `resolution` seconds"""
+        return ge.history(self.id, start, end, resolution)
+
     def get_best_price(self):
         r = osb_lookup(self.id)[self.id]
         if r:
@@ -67,7 +94,177 @@ class Item:
     def __int__(self):
         return self.id
 
+    def __reduce__(self):
+        # much faster to unpickle than the attrs slots __setstate__
+        return Item, (self.id, self.name, self.desc, self.alch, self.membs,
+                      self.ge_cache_priority)
+
 isiteminstance=Item.__instancecheck__
+
+class ItemColumns(Mapping):
+    """Read-only id: Item mapping storing the catalogue column-wise
+
+    ids, alch, membs and ge_cache_priority are kept in arrays sorted by
+    id, and every name and description in one string sliced by
+    `offsets`. Items are only created when looked up, so each lookup
+    returns a new (but equal) Item and changing one has no effect on
+    the store.
+    """
+
+    def __init__(self, records):
+        records = sorted(records, key=operator.itemgetter('id'))
+        self.ids = array('q', [i['id'] for i in records])
+        self.alch = array('q', [i['alch'] for i in records])
+        self.membs = array('b', [bool(i['membs']) for i in records])
+        self.priority = array('q', [i.get('ge_cache_priority', 0)
+                                    for i in records])
+        offsets = array('Q', [0])
+        text = []
+        for record in records:
+            for key in ('name', 'desc'):
+                text.append(record[key] or '')
+                offsets.append(offsets[-1] + len(text[-1]))
+        self.text = ''.join(text)
+        self.offsets = offsets
+        lower = self._lower
+        self.by_name_order = array('L', sorted(range(len(records)), key=lower))
+        self.by_name = _ItemColumnsByName(self)
+
+    def _text(self, i):
+        offsets = self.offsets
+        return self.text[offsets[i]:offsets[i+1]]
+
+    def _lower(self, row):
+        return self._text(2*row).lower()
+
+    def _row(self, id):
+        ids = self.ids
+        row = bisect_left(ids, id)
+        if row < len(ids) and ids[row] == id:
+            return row
+        raise KeyError(id)
+
+    def item(self, row):
+        return Item(id=self.ids[row],
+                    name=self._text(2*row),
+                    desc=self._text(2*row+1),
+                    alch=self.alch[row],
+                    membs=bool(self.membs[row]),
+                    ge_cache_priority=self.priority[row])
+
+    def __getitem__(self, id):
+        return self.item(self._row(id))
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def values(self):
+        return _ItemColumnsValues(self)
+
+    @property
+    def nbytes(self):
+        return sum(map(sys.getsizeof, (self.ids, self.alch, self.membs,
+                                       self.priority, self.offsets,
+                                       self.text, self.by_name_order)))
+
+    def dump(self, fp, extra=b''):
+        """Write the columns to `fp` in the layout SharedItemColumns
+        reads, with the text as utf-8 and `extra` bytes at the end"""
+        text = [self._text(i).encode() for i in range(len(self.offsets)-1)]
+        offsets = array('Q', [0])
+        for chunk in text:
+            offsets.append(offsets[-1] + len(chunk))
+        text = b''.join(text)
+        fp.write(_SHARED_HEADER.pack(_SHARED_MAGIC, len(self), len(text),
+                                     len(extra)))
+        for section in (array('q', self.ids), array('q', self.alch),
+                        array('q', self.priority), offsets,
+                        array('q', self.by_name_order),
+                        array('b', self.membs), text, extra):
+            section = bytes(section)
+            fp.write(section)
+            fp.write(bytes(-len(section) % 8))
+
+_SHARED_HEADER = struct.Struct('<8sQQQ') # magic, items, text and extra size
+_SHARED_MAGIC = b'ohseven\x01'
+
+class SharedItemColumns(ItemColumns):
+    """ItemColumns over a buffer written by ItemColumns.dump, usually a
+    read-only mmap of a file, so any number of processes can share one
+    copy of the catalogue and attaching to it costs next to nothing.
+
+    The text is utf-8, decoded as items are looked up. `extra` is the
+    extra bytes that were dumped with the columns.
+    """
+
+    def __init__(self, buffer):
+        magic, n, text_size, extra_size = _SHARED_HEADER.unpack_from(buffer)
+        if magic != _SHARED_MAGIC:
+            error = ValueError('not a shared item catalogue')
+            raise error
+        view = memoryview(buffer)
+        pos = _SHARED_HEADER.size
+        def section(size, format=None):
+            nonlocal pos
+            result = view[pos:pos+size]
+            pos += size + -size % 8
+            return result.cast(format) if format else result
+        self.ids = section(8*n, 'q')
+        self.alch = section(8*n, 'q')
+        self.priority = section(8*n, 'q')
+        self.offsets = section(8*(2*n+1), 'Q')
+        self.by_name_order = section(8*n, 'q')
+        self.membs = section(n, 'b')
+        self.text = section(text_size)
+        self.extra = section(extra_size)
+        self.by_name = _ItemColumnsByName(self)
+
+    def _text(self, i):
+        offsets = self.offsets
+        return str(self.text[offsets[i]:offsets[i+1]], 'utf-8')
+
+class _ItemColumnsValues(ValuesView):
+    """values() of an ItemColumns, made row by row rather than by id"""
+
+    def __iter__(self):
+        columns = self._mapping
+        return map(columns.item, range(len(columns)))
+
+class _ItemColumnsByName(Mapping):
+    """Lowercased name: Item view of an ItemColumns, searched by bisection
+
+    Like the dict of the default store, the last row of a name that
+    several items share wins.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+
+    def __getitem__(self, name):
+        columns = self._columns
+        order = columns.by_name_order
+        lower = columns._lower
+        # the sort is stable, so the last row of a name is the last of
+        # its run in order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if name < lower(order[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo and lower(order[lo-1]) == name:
+            return columns.item(order[lo-1])
+        raise KeyError(name)
+
+    def __iter__(self):
+        return map(self._columns._lower, self._columns.by_name_order)
+
+    def __len__(self):
+        return len(self._columns)
 @safe_repr
 class ItemSet(frozenset):
     """Indexable frozenset subclass for holding sets of `Item` instances
@@ -166,6 +363,37 @@ class ItemSet(frozenset):
         """Map `self` to a dict of Item: desc pairs."""
         return self._get_info('desc')
     
+    def to_arrays(self, *, fetch_ge=False):
+        """ItemArrays of the id, alch, membs, GE and OSB price columns,
+        in order, for vectorized analytics such as
+            view_items().to_arrays().best_alchs(10)
+
+        OSB prices come from one catalogue download. GE prices are the
+        cached ones unless `fetch_ge`, which looks up the rest (slowly,
+        they're rate limited)."""
+        link = self.__link
+        ids = [i.id for i in link]
+        osb_prices = osb_lookup(*ids, NATURE_RUNE)
+        if fetch_ge:
+            for i in range(0, len(ids), 100):
+                ge_lookup(*ids[i:i+100])
+        ge.load_pending_cache()
+        ge_prices = ge.cache.snapshot()
+        def prices(found, ids):
+            return [found[i].price if i in found else 0 for i in ids]
+        osb_nature, ge_nature = prices(osb_prices, [NATURE_RUNE]) + \
+                                prices(ge_prices, [NATURE_RUNE])
+        return ItemArrays(ids,
+                          [i.alch for i in link],
+                          [i.membs for i in link],
+                          prices(ge_prices, ids),
+                          prices(osb_prices, ids),
+                          nature_rune=osb_nature or ge_nature)
+
+    def to_frame(self, *, fetch_ge=False):
+        """pandas DataFrame of `to_arrays`"""
+        return self.to_arrays(fetch_ge=fetch_ge).to_frame()
+
     def sorted_by(self, attribute, *, reverse=False):
         """Sort `self` according to each Item in `self`'s attributes"""
         link = self.__link
@@ -196,17 +424,26 @@ class ItemSet(frozenset):
     def __getitem__(self, index):
         return self.__link[index]
     
+    def _ordered(self, result, other):
+        """`result` of a set operation, in the order of self then other"""
+        if result is NotImplemented:
+            return result
+        members = frozenset.__contains__
+        order = itertools.chain(self.__link, other)
+        return self._from_itemset([*dict.fromkeys(i for i in order
+                                                  if members(result, i))])
+
     def __or__(self, other):
-        return self._from_itemset(super().__or__(other))
+        return self._ordered(super().__or__(other), other)
 
     def __xor__(self, other):
-        return self._from_itemset(super().__xor__(other))
+        return self._ordered(super().__xor__(other), other)
 
     def __sub__(self, other):
-        return self._from_itemset(super().__sub__(other))
+        return self._ordered(super().__sub__(other), other)
 
     def __and__(self, other):
-        return self._from_itemset(super().__and__(other))
+        return self._ordered(super().__and__(other), other)
 
     __ror__ = union = __or__
     __rxor__ = symmetric_difference = __xor__
@@ -230,9 +467,522 @@ class osb_info(_PriceInfo, namedtuple('info',('id', 'price', 'time'))):
     def as_dict(self):
         return {'price':self.price, 'time':self.time}
 
-class _Interface:
+PriceCacheInfo = namedtuple('PriceCacheInfo', ('hits', 'stale_hits', 'misses',
+                                               'expirations', 'evictions',
+                                               'maxsize', 'currsize'))
+
+class _Untracked(set):
+    """Changes of a PriceCache that does not track them, always empty"""
+
+    def add(self, id):
+        pass
+
+    def update(self, *ids):
+        pass
+
+class PriceCache(MutableMapping):
+    """{id: price info} where every entry expires on its own.
+
+    An entry is fresh until `ttl` seconds after its price's `time` (but
+    at least `min_ttl` seconds after it was cached), and is stale rather
+    than gone for `stale_ttl` seconds after that, so it can still be
+    served while it is looked up again. Entries older than `min_time` are
+    stale straight away. With a `maxsize` the least recently used entries
+    are evicted.
+
+    Plain item access never counts as a hit or miss; `lookup` does.
+    Every id set or removed since the last `take_changes` is tracked so
+    that only those need to be written out, unless `track_changes` is
+    False for a cache that is never written out.
+
+    After `share`, entries are also read from (and, if it is writable,
+    written to) a SharedPriceTable, so one process can keep the prices
+    of many up to date.
+    """
+
+    def __init__(self, ttl, *, stale_ttl=0, min_ttl=300, maxsize=None,
+                 track_changes=True):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_ttl = min_ttl
+        self.maxsize = maxsize
+        self.min_time = 0
+        self._data = OrderedDict() # id: (info, expires)
+        self._changed = set() if track_changes else _Untracked()
+        self._lock = threading.RLock()
+        self._shared = None
+        self.hits = self.stale_hits = self.misses = 0
+        self.expirations = self.evictions = 0
+
+    def __getitem__(self, id):
+        return self._data[id][0]
+
+    def __setitem__(self, id, info):
+        ttl = self.ttl() if callable(self.ttl) else self.ttl
+        expires = max(info.time+ttl, time_in_seconds()+self.min_ttl)
+        with self._lock:
+            self._set(id, info, expires)
+            self._changed.add(id)
+
+    def share(self, table, source, info_class):
+        """Use the `source` column of SharedPriceTable `table` for entries
+        that are missing or older here, creating them with `info_class`"""
+        with self._lock:
+            self._shared = table, source, info_class
+            if table.writable:
+                for id, (info, expires) in self._data.items():
+                    table.put(id, source, info.price, info.time, expires)
+
+    def _set(self, id, info, expires):
+        data = self._data
+        data[id] = info, expires
+        data.move_to_end(id)
+        if self._shared is not None:
+            self._publish(id, info, expires)
+        if self.maxsize is not None:
+            while len(data) > self.maxsize:
+                evicted, entry = data.popitem(last=False)
+                self._changed.add(evicted)
+                self.evictions += 1
+
+    def __delitem__(self, id):
+        with self._lock:
+            del self._data[id]
+            self._changed.add(id)
+
+    def __iter__(self):
+        return iter([*self._data])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, id):
+        return id in self._data
+
+    def due(self, id):
+        """When `id` should be looked up again (0 if it isn't cached)"""
+        entry = self._data.get(id)
+        if entry is None:
+            return 0
+        info, expires = entry
+        return expires if info.time >= self.min_time else 0
+
+    def _publish(self, id, info, expires):
+        table, source, info_class = self._shared
+        if table.writable:
+            table.put(id, source, info.price, info.time, expires)
+
+    def _from_shared(self, id, entry):
+        table, source, info_class = self._shared
+        found = table.get(id, source)
+        if found is None or entry is not None and entry[1] >= found[2]:
+            return entry
+        price, updated, expires = found
+        entry = info_class(id, price, updated), expires
+        self._data[id] = entry
+        return entry
+
+    def lookup(self, id):
+        """(info, is_fresh) for `id`, or (None, False) if it is not
+        cached or is too stale to use"""
+        with self._lock:
+            entry = self._data.get(id)
+            if self._shared is not None:
+                entry = self._from_shared(id, entry)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            info, expires = entry
+            now = time_in_seconds()
+            if now < expires and info.time >= self.min_time:
+                self._data.move_to_end(id)
+                self.hits += 1
+                return info, True
+            if now < expires + self.stale_ttl:
+                self._data.move_to_end(id)
+                self.stale_hits += 1
+                return info, False
+            del self._data[id]
+            self._changed.add(id)
+            self.expirations += 1
+            self.misses += 1
+            return None, False
+
+    def clear(self):
+        with self._lock:
+            self._changed.update(self._data)
+            self._data.clear()
+
+    def touch(self, ids, now):
+        """Count the cached `ids` as confirmed unchanged at `now`"""
+        ttl = self.ttl() if callable(self.ttl) else self.ttl
+        expires = max(now+ttl, time_in_seconds()+self.min_ttl)
+        with self._lock:
+            data = self._data
+            for id in ids:
+                entry = data.get(id)
+                if entry is not None:
+                    data[id] = entry[0], expires
+                    if self._shared is not None:
+                        self._publish(id, entry[0], expires)
+
+    def restore(self, infos):
+        """Cache `infos` as they were when written out, without counting
+        them as changes"""
+        with self._lock:
+            ttl = self.ttl() if callable(self.ttl) else self.ttl
+            now = time_in_seconds()
+            for info in infos:
+                expires = info.time + ttl
+                if expires > now:
+                    # what is still fresh gets min_ttl from now to be refreshed
+                    expires = max(expires, now+self.min_ttl)
+                self._set(info.id, info, expires)
+
+    def snapshot(self):
+        """{id: info} of everything cached"""
+        with self._lock:
+            return {id:entry[0] for id, entry in self._data.items()}
+
+    def take_changes(self):
+        """{id: info, or None if it was removed} of what changed since the
+        last call"""
+        with self._lock:
+            data = self._data
+            changes = {id:data[id][0] if id in data else None
+                       for id in self._changed}
+            self._changed.clear()
+            return changes
+
+    def mark_changed(self, ids):
+        with self._lock:
+            self._changed.update(ids)
+
+    def info(self):
+        return PriceCacheInfo(self.hits, self.stale_hits, self.misses,
+                              self.expirations, self.evictions,
+                              self.maxsize, len(self._data))
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} object with {len(self)} '
+                f'items at 0x{id(self):08X}>')
+
+_PRICES_HEADER = struct.Struct('<8sQ') # magic, items
+_PRICES_MAGIC = b'ohsevenp'
+
+class SharedPriceTable:
+    """The (price, time, expires) of every item from each of `sources`,
+    in a buffer (usually an mmap'd file) written by one process and read
+    by any number of others.
+
+    Each price has a sequence number that is odd while it is being
+    written, so readers retry instead of seeing half of an update.
+    """
+
+    sources = ('ge', 'osb')
+    width = 4 # sequence, price, time, expires
+    # reads of a price being written retried before giving up on it
+    max_retries = 100
+
+    def __init__(self, buffer):
+        magic, n = _PRICES_HEADER.unpack_from(buffer)
+        if magic != _PRICES_MAGIC:
+            error = ValueError('not a shared price table')
+            raise error
+        view = memoryview(buffer)
+        start = _PRICES_HEADER.size
+        end = start + 8*n
+        self.ids = view[start:end].cast('q')
+        self.rows = view[end:end + 8*n*self.width*len(self.sources)].cast('q')
+        self.writable = not view.readonly
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, ids):
+        """A writable table of `ids` in a new file at `path`"""
+        ids = array('q', sorted(ids))
+        size = 8*len(ids)*cls.width*len(cls.sources)
+        temp = path.with_name(f'{path.name}.tmp')
+        with open(temp, 'wb') as fp:
+            fp.write(_PRICES_HEADER.pack(_PRICES_MAGIC, len(ids)))
+            fp.write(bytes(ids))
+            fp.truncate(fp.tell() + size)
+        os.replace(temp, path)
+        with open(path, 'r+b') as fp:
+            return cls(mmap.mmap(fp.fileno(), 0))
+
+    @classmethod
+    def open(cls, path):
+        """A read-only view of the table at `path`"""
+        with open(path, 'rb') as fp:
+            return cls(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _slot(self, id, source):
+        ids = self.ids
+        row = bisect_left(ids, id)
+        if row == len(ids) or ids[row] != id:
+            return None
+        return (row*len(self.sources) + self.sources.index(source)) * self.width
+
+    def get(self, id, source):
+        """(price, time, expires) of `id` from `source`, or None if there
+        is none or it stays half written (say its writer died mid-put)"""
+        slot = self._slot(id, source)
+        if slot is None:
+            return None
+        rows = self.rows
+        for retry in range(self.max_retries):
+            sequence = rows[slot]
+            if not sequence & 1:
+                price, updated, expires = rows[slot+1:slot+4]
+                if rows[slot] == sequence:
+                    return (price, updated, expires) if updated else None
+            time.sleep(0)
+        return None
+
+    def put(self, id, source, price, updated, expires):
+        """Set the price of `id` from `source`, if the table has it"""
+        slot = self._slot(id, source)
+        if slot is None:
+            return False
+        rows = self.rows
+        with self._lock:
+            rows[slot] += 1
+            rows[slot+1:slot+4] = array('q', (price, updated, int(expires)))
+            rows[slot] += 1
+        return True
+
+class CacheStore(ABC):
+    """Where an interface's PriceCache is written out. Entries are saved
+    as {id: (price, time)} and removed ones as None."""
+
+    suffix = ''
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return self.path.exists()
+
+    @abstractmethod
+    def load(self):
+        """{id: (price, time)} of everything stored, without changing
+        the store"""
+
+    @abstractmethod
+    def write(self, changes, snapshot):
+        """Store `changes` ({id: info or None}). `snapshot()` returns every
+        entry in case the store wants to rewrite itself from scratch."""
+
+    @abstractmethod
+    def compact(self, infos):
+        """Atomically replace the store with just `infos` ({id: info})"""
+
+def _number(s):
+    return float(s) if b'.' in s else int(s)
+
+def _trim_torn_line(fp):
+    """Cut a line that the last write left unfinished off the end of
+    `fp`, reading back only as far as the last newline"""
+    size = end = fp.seek(0, os.SEEK_END)
+    while end:
+        start = max(0, end - 4096)
+        fp.seek(start)
+        i = fp.read(end - start).rfind(b'\n')
+        if i >= 0:
+            end = start + i + 1
+            break
+        end = start
+    if end != size:
+        fp.truncate(end)
+    fp.seek(end)
+
+def _is_json_cache(path):
+    """Whether `path` is a cache file in the JSON format the stores
+    replaced: a JSON object, after a last update line for the GE"""
+    with open(path, 'rb') as fp:
+        first, _, rest = fp.read(64).partition(b'\n')
+    first = first.strip()
+    return (first.startswith(b'{')
+            or first.isdigit() and rest.lstrip().startswith(b'{'))
+
+class LogCacheStore(CacheStore):
+    """Append-only log of "id price time" lines, with a bare "id" line
+    when an entry is removed. Once it has `compact_ratio` times more lines
+    than entries it's rewritten with only the live ones."""
+
+    suffix = '.log'
+    compact_ratio = 2
+    # compacting a tiny log isn't worth it
+    min_compact_lines = 1000
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.lines = 0
+
+    def load(self):
+        with self._lock, open(self.path, 'rb') as fp:
+            data = fp.read()
+        # the last write may have been cut short, leave out a torn line
+        # (write trims it before appending)
+        entries = {}
+        lines = data[:data.rfind(b'\n')+1].splitlines()
+        for line in lines:
+            fields = line.split()
+            try:
+                if len(fields) == 3:
+                    id, price, t = fields
+                    entries[int(id)] = _number(price), int(t)
+                elif len(fields) == 1:
+                    entries.pop(int(fields[0]), None)
+            except ValueError:
+                continue
+        self.lines = len(lines)
+        return entries
+
+    def write(self, changes, snapshot):
+        if not changes:
+            return
+        lines = ''.join(f'{id}\n' if v is None else f'{id} {v.price} {v.time}\n'
+                        for id, v in changes.items())
+        with self._lock:
+            with open(self.path, 'ab+') as fp:
+                # don't append to a line the last write left torn
+                _trim_torn_line(fp)
+                fp.write(lines.encode())
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.lines += len(changes)
+            lines = self.lines
+        if lines >= self.min_compact_lines:
+            infos = snapshot()
+            if lines > self.compact_ratio * len(infos):
+                self.compact(infos)
+
+    def compact(self, infos):
+        temp = self.path.with_name(f'{self.path.name}.tmp')
+        with self._lock:
+            with open(temp, 'w') as fp:
+                fp.write(''.join(f'{id} {v.price} {v.time}\n'
+                                 for id, v in infos.items()))
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp, self.path)
+            self.lines = len(infos)
+
+class SQLiteCacheStore(CacheStore):
+    """Entries kept in a local SQLite table, changed a transaction at a
+    time"""
+
+    suffix = '.sqlite3'
+
+    def _connect(self, path=None):
+        db = sqlite3.connect(path or self.path, timeout=30)
+        db.execute('CREATE TABLE IF NOT EXISTS prices '
+                   '(id INTEGER PRIMARY KEY, price, time INTEGER)')
+        return db
+
+    def load(self):
+        with closing(self._connect()) as db:
+            return {id:(price, t) for id, price, t
+                    in db.execute('SELECT id, price, time FROM prices')}
+
+    def write(self, changes, snapshot):
+        if not changes:
+            return
+        with closing(self._connect()) as db, db:
+            db.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?)',
+                           [(id, v.price, v.time) for id, v in changes.items()
+                            if v is not None])
+            db.executemany('DELETE FROM prices WHERE id = ?',
+                           [(id,) for id, v in changes.items() if v is None])
+
+    def compact(self, infos):
+        temp = self.path.with_name(f'{self.path.name}.tmp')
+        if temp.exists():
+            temp.unlink()
+        with closing(self._connect(temp)) as db, db:
+            db.executemany('INSERT INTO prices VALUES (?, ?, ?)',
+                           [(id, v.price, v.time) for id, v in infos.items()])
+        with self._lock:
+            os.replace(temp, self.path)
+
+class _Flights:
+    """Single-flight calls run in a thread pool, for the lookups of a
+    `cache` through a `_fetch(key)` method"""
+
+    # most requests made at once by the async lookups
+    max_concurrency = 16
+
+    def _init_flights(self):
+        self._executor = None
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _flight(self, key):
+        """(future, is_new) of the call in flight for `key`"""
+        with self._flights_lock:
+            future = self._flights.get(key)
+            if future is None:
+                future = self._flights[key] = Future()
+                return future, True
+            return future, False
+
+    def _fly(self, key, future, func, *args):
+        try:
+            result = func(*args)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+
+    def _single_flight(self, key, func, *args):
+        """func(*args), unless a call for `key` is already in flight, in
+        which case wait for that one's result instead"""
+        future, new = self._flight(key)
+        if new:
+            self._fly(key, future, func, *args)
+        return future.result()
+
+    def _start(self, key, func, *args):
+        """Future of `_single_flight(key, func, *args)` run in the
+        interface's thread pool"""
+        future, new = self._flight(key)
+        if new:
+            if self._executor is None:
+                with self._flights_lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(self.max_concurrency)
+            self._executor.submit(self._fly, key, future, func, *args)
+        return future
+
+    def _submit(self, key, func, *args):
+        # asyncio is only imported once it's used, it's slow to import
+        import asyncio
+        return asyncio.wrap_future(self._start(key, func, *args))
+
+    def _from_cache(self, ids):
+        """{id: info} of the usable cached ids, looking the stale ones up
+        again in the background"""
+        lookup = self.cache.lookup
+        results = {}
+        for id in ids:
+            info, fresh = lookup(id)
+            if info is not None:
+                results[id] = info
+                if not fresh:
+                    self._start(id, self._fetch, id)
+        return results
+
+class _Interface(_Flights):
     
     __instances = {}
+    # how the cache is saved; the file is the cache file with its suffix
+    cache_store = LogCacheStore
 
     def __init_subclass__(cls, *, cache, info_class=None,
                           cache_file_key=None, price_lookup_url_key=None):
@@ -240,8 +990,8 @@ class _Interface:
         error = None
         if info_class is None:
             error = TypeError(f'{name} subclass requires `info_class` argument.')
-        elif not isdictinstance(cache):
-            error = TypeError(f'{name} subclass `cache` should be a dict instance.')
+        elif not isinstance(cache, PriceCache):
+            error = TypeError(f'{name} subclass `cache` should be a PriceCache instance.')
         elif cache_file_key not in CONFIG.filenames:
             error = ValueError(f'{name} subclass: bad FILENAME key in `cache_file`.')
         elif price_lookup_url_key not in CONFIG.item_data_urls:
@@ -259,25 +1009,28 @@ class _Interface:
             instance.cache.clear()
             instance.last_check = 0
             instance.last_update = 0
-            instance._thread = None
-            instance._exceptions = {}
-            instance.requests = {}
+            instance._scheduler = None
+            instance._store = None
+            instance._cache_pending = False
+            instance._init_flights()
             return instance
         return __class__.__instances[cls]
     
-    def auto_cache(self):
-        if self._is_autocaching:
-            return True
-        self._thread = threading.Thread(target=self._auto_cache)
-        self._thread.start()
+    def auto_cache(self, on_error=None):
+        """Keep the cache warm in the background until `stop_auto_cache`,
+        calling on_error(key, exception) when a refresh fails"""
+        if not self._is_autocaching:
+            self._scheduler = RefreshScheduler(self, on_error=on_error)
+            self._scheduler.start()
+        return self._scheduler
 
-    def _get_most_recent_requests(self, t):
-        t = time_in_seconds() - t
-        return {k:v for k, v in self.requests.items() if k >= t}
+    def stop_auto_cache(self, timeout=None):
+        if self._scheduler is not None:
+            self._scheduler.stop(timeout)
 
     @property
     def _is_autocaching(self):
-        return False if not self._thread else self._thread.is_alive()
+        return self._scheduler is not None and self._scheduler.running
     
     @property
     def cache_file(self):
@@ -287,19 +1040,118 @@ class _Interface:
     def price_url(self):
         return CONFIG.item_data_urls[self._price_url_key]
 
+    @property
+    def store(self):
+        store = self._store
+        if store is None:
+            path = self.cache_file
+            store = self._store = self.cache_store(
+                path.with_suffix(self.cache_store.suffix))
+        return store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
+
+    def load_pending_cache(self):
+        """Load the cache file if loading it was deferred until first use"""
+        if self._cache_pending:
+            self._cache_pending = False
+            self.load_cache()
+
+    def load_cache(self, path_override=None):
+        """Load the cache store (or the given store file). Without one,
+        the old JSON cache file is loaded and marked as changed so the
+        next dump_cache moves it into the store."""
+        if path_override:
+            path = pathlib.Path(path_override)
+            if path.exists() and _is_json_cache(path):
+                # an old JSON cache file, which the store can't read
+                self.cache.mark_changed(self._load_json_cache(path))
+                return
+            store = self.cache_store(path)
+        else:
+            store = self.store
+        if store.exists():
+            info = self._info_class
+            infos = [info(id, price, t) for id, (price, t) in store.load().items()]
+            self.cache.restore(infos)
+            self._loaded(infos)
+        elif not path_override and self.cache_file.exists():
+            self.cache.mark_changed(self._load_json_cache(self.cache_file))
+
+    def _loaded(self, infos):
+        pass
+
+    def dump_cache(self, path_override=None, backup_path=None):
+        """Write what changed in the cache since the last dump to the
+        store, or everything to a new store at `path_override`"""
+        self.load_pending_cache()
+        store = self.store
+        if backup_path and store.exists():
+            backup_file(store.path, pathlib.Path(backup_path))
+        cache = self.cache
+        if path_override:
+            self.cache_store(path_override).compact(cache.snapshot())
+            return
+        changes = cache.take_changes()
+        try:
+            if not store.exists():
+                store.compact(cache.snapshot())
+            else:
+                store.write(changes, cache.snapshot)
+        except:
+            cache.mark_changed(changes)
+            raise
+
     def lookup_from_cache(self, *ids):
+        self.load_pending_cache()
         ids = [*map(int, {*ids})]
         return {i:v for i, v in zip(ids, map(self.cache.get, ids))}
     
+    def cache_info(self):
+        return self.cache.info()
+
+    def _fetch(self, id, *args):
+        """(id, info or exception) of one uncached lookup, caching info"""
+        id, result = self._lookup(id, *args)
+        if isexceptioninstance(result):
+            return id, result
+        result = self._info_class(**result)
+        if result.time > self.last_update:
+            # prices were updated, so everything cached before is stale
+            self.last_update = self.cache.min_time = result.time
+        self.cache[id] = result
+        self.last_check = time_in_seconds()
+        return id, result
+
+    async def alookup_iter(self, *ids):
+        """Asynchronously yield (id, info or exception) pairs for `ids`
+        as each one becomes available, cached ones first.
+
+        At most `max_concurrency` requests run at once through the shared
+        TRANSPORT, and concurrent lookups of the same id (sync or async)
+        share one request.
+        """
+        import asyncio
+        self.load_pending_cache()
+        ids = {*map(int, ids)}
+        cached = self._from_cache(ids)
+        for pair in cached.items():
+            yield pair
+        futures = [self._submit(id, self._fetch, id) for id in ids - cached.keys()]
+        for future in asyncio.as_completed(futures):
+            yield await future
+
+    async def alookup(self, *ids):
+        """Asynchronous `lookup` without the 100 id limit"""
+        return DotDict([pair async for pair in self.alookup_iter(*ids)])
+
     def lookup(self, *ids):
+        self.load_pending_cache()
         results = {}
-        cached_results = {}
         ids = {*map(int, ids)}
-        check = time_in_seconds()
-        if check - self.last_check < 300:
-            cached_results = self.lookup_from_cache(*ids)
-            cached_results = {k:v for k, v in cached_results.items()
-                              if v is not None}
+        cached_results = self._from_cache(ids)
         ids -= cached_results.keys()
         if not ids:
             return cached_results
@@ -307,73 +1159,146 @@ class _Interface:
             error = Exception('cannot look up more than 100 items at a time.')
             raise error
         exceptions = {}
-        info = self._info_class
+        single_flight = self._single_flight
         with ThreadPoolExecutor(len(ids)) as executrix:
-            futures = map(executrix.submit, itertools.repeat(self._lookup), ids)
+            futures = [executrix.submit(single_flight, id, self._fetch, id)
+                       for id in ids]
             for future in as_completed(futures):
                 id, result = future.result()
                 if isexceptioninstance(result):
                     exceptions[id] = result
                 else:
-                    results[id] = info(**result)
-        for i, v in results.items():
-            if v.time > self.last_update:
-                self.cache.clear()
-                self.last_update = v.time
-                cached_results = self.lookup(*cached_results)
-                break
-        for i, v in results.items():
-            self.cache[i] = v
-        self.last_check = check        
+                    results[id] = result
         return DotDict(**cached_results, **results, **exceptions)
 
+CatalogueEntry = namedtuple('CatalogueEntry',
+                            ('price', 'name', 'store_price', 'members'))
+
+class OSBCatalogue:
+    """The last downloaded OSB summary catalogue as {id: CatalogueEntry}
+
+    Each download is parsed as it streams in and compared with the
+    previous one, so only what changed has to be dealt with.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.last_check = 0
+
+    def refresh(self, url):
+        """Download the catalogue again and return the {id: entry} of
+        the new or changed entries and the set of ids no longer in it"""
+        old = self.entries
+        entries = {}
+        changed = {}
+        ignore = {*OSB_IGNORE}
+        response = TRANSPORT.get(url, stream=True)
+        with closing(response):
+            response.raise_for_status()
+            for k, v in iter_json_object(response.iter_content(2**16)):
+                if k in ignore:
+                    continue
+                id = int(k)
+                entry = old.get(id)
+                if (entry is None
+                    or entry.price != v['overall_average']
+                    or entry.store_price != v['sp']
+                    or entry.name != v['name']
+                    or entry.members != v['members']):
+                    entry = changed[id] = CatalogueEntry(
+                        v['overall_average'], v['name'], v['sp'], v['members'])
+                entries[id] = entry
+        self.entries = entries
+        self.last_check = time_in_seconds()
+        return changed, old.keys() - entries.keys()
+
 class OSBInterface(_Interface,
-                   cache=DotDict(),
+                   cache=PriceCache(
+                       lambda: CONFIG.cache_settings.osb_cache_duration,
+                       stale_ttl=CONFIG.cache_settings.osb_cache_duration),
                    info_class=osb_info,
                    cache_file_key='osb_cache',
                    price_lookup_url_key='osb_price_api'):
 
+    catalogue = OSBCatalogue()
+
     @property
     def price_catalogue_url(self):
         return CONFIG.item_data_urls.osb_catalogue
-    
-    def lookup(self, *ids):
-        ids = {*map(int, ids)}
+
+    def _cached(self, ids):
+        """Results for `ids` from the cache, or None if the catalogue
+        has to be downloaded again. Stale results are returned while the
+        catalogue is downloaded in the background."""
+        info = self._info_class
+        lookup = self.cache.lookup
+        # nothing gets any fresher than a catalogue that was just checked
+        checked = time_in_seconds() - self.last_check < self.cache.min_ttl
+        cached_result = {}
+        stale = False
+        for id in ids:
+            cached, fresh = lookup(id)
+            if cached is None:
+                if not checked:
+                    return None
+                # it's not in the catalogue
+                cached = info(id=id, price=0, time=self.last_check)
+            elif not fresh:
+                stale = True
+            cached_result[id] = cached
+        if stale and not checked:
+            self._start('catalogue', self.refresh)
+        return cached_result
+
+    def refresh(self):
+        """Download the price catalogue, caching the prices that changed
+        (and keeping the rest), and return the {id: osb_info} of those"""
         info = self._info_class
         cache = self.cache
-        cache_get = cache.get
-        check = time_in_seconds()
+        changed, removed = self.catalogue.refresh(self.price_catalogue_url)
+        check = self.catalogue.last_check
+        entries = self.catalogue.entries
+        # and whatever has dropped out of the cache since
+        changed.update((id, entries[id]) for id in entries.keys() - cache.keys())
         results = {}
-        oldest = check - CONFIG.cache_settings.osb_cache_duration
-        if check - self.last_check < 300:
-            cached_result = {}
-            for id in ids:
-                cached = cache_get(id)
-                if cached:
-                    if cached.time >= oldest:
-                        cached_result[id] = cached
-                        continue
-                    else:
-                        break
-                cached_result[id] = info(id=id, price=0, time=self.last_check)
-            else:
-                return cached_result        
-        response = requests.get(self.price_catalogue_url)
-        data = {k:v for k, v in response.json().items() if k not in OSB_IGNORE}        
-        for k, v in data.items():
-            id = int(k)
-            price = v['overall_average']
-            result = info(id=id, price=price, time=check)
-            if price:
-                cache[id] = result
-            else:
-                cached = cache_get(id)
-                if cached:
-                    result = cached
-            if id in ids:
-                results[id] = result
+        for id, entry in changed.items():
+            # no price means nobody traded it lately, keep the last one
+            if entry.price:
+                results[id] = cache[id] = info(id=id, price=entry.price,
+                                               time=check)
+        cache.touch(entries.keys() - results.keys(), check)
         self.last_check = check
         return results
+
+    def catalogue_entries(self, max_age=300):
+        """{id: CatalogueEntry} of the catalogue, downloading it again if
+        it's more than `max_age` seconds old"""
+        if time_in_seconds() - self.catalogue.last_check > max_age:
+            self._single_flight('catalogue', self.refresh)
+        return self.catalogue.entries
+
+    async def alookup_iter(self, *ids):
+        """Asynchronously yield (id, osb_info) pairs for `ids`.
+
+        All of them come from one catalogue download, which concurrent
+        lookups share."""
+        self.load_pending_cache()
+        ids = {*map(int, ids)}
+        results = self._cached(ids)
+        if results is None:
+            await self._submit('catalogue', self.refresh)
+            results = self._cached(ids)
+        for pair in results.items():
+            yield pair
+
+    def lookup(self, *ids):
+        self.load_pending_cache()
+        ids = {*map(int, ids)}
+        cached_result = self._cached(ids)
+        if cached_result is None:
+            self._single_flight('catalogue', self.refresh)
+            cached_result = self._cached(ids)
+        return cached_result
     
     def _lookup_individual(self, id):
         
@@ -381,22 +1306,12 @@ class OSBInterface(_Interface,
         try:
             if not get(id):
                 raise NonExistentItemError('id', id)
-            self.requests.setdefault(check, 0)
-            self.requests[check] += 1
             cached_result = self.cache.get(id)
             if cached_result is not None:
                 if cached_result.delta < CACHE_SETTINGS.osb_cache_duration:
                     return cached_result
-            for i in range(5):
-                response = requests.get(self.price_url%id, timeout=.5)
-                if response.ok:
-                    text = response.text
-                    if text:
-                        j = DotDict(response.json())
-                        break
-                time.sleep(.05)
-            else:
-                j = DotDict(response.json())    
+            response = TRANSPORT.get(self.price_url%id, timeout=.5)
+            j = DotDict(response.json())
             price = j.overall or j.selling or j.buying
             if price:
                 result = dict(
@@ -414,54 +1329,32 @@ class OSBInterface(_Interface,
         except Exception as error:
             return id, error
 
-    def dump_cache(self, path_override=None, backup_path=None):
-        if path_override:
-            path = pathlib.Path(path_override)
-        else:
-            path = self.cache_file
-        if backup_path:
-            backup_file(path, pathlib.Path(backup_path))
-        c = {k:v.as_dict() for k, v in self.cache.items()}
-        with open(path, 'w') as fp:
-            json.dump(c, fp, indent=1)
-
-    def load_cache(self, path_override=None):
-        if path_override:
-            path = pathlib.Path(path_override)
-        else:
-            path = self.cache_file
+    def _load_json_cache(self, path):
         with open(path) as fp:
             c = json.load(fp)
-        self.cache.update({k:self._info_class(id=k, **v) for k, v in c.items()})
+        c = {int(k):self._info_class(id=int(k), **v) for k, v in c.items()}
+        self.cache.restore(c.values())
+        return c
+
+    def _schedule(self):
+        return [(self.last_check+self._refresh_interval(), 0, 'catalogue')]
+
+    def _refresh_interval(self):
+        return CONFIG.cache_settings.osb_auto_cache_frequency
 
-    def _auto_cache(self):
-        while True:
-            self.lookup()
-            time.sleep(CONFIG.cache_settings.osb_auto_cache_frequency)
+    def _refresh(self, key):
+        self._single_flight(key, self.refresh)
+        return time_in_seconds() + self._refresh_interval()
             
 class GeInterface(_Interface,
-                  cache=DotDict(),
+                  # prices are updated once a day
+                  cache=PriceCache(86400, stale_ttl=86400),
                   info_class=ge_info,
                   cache_file_key='ge_cache',
                   price_lookup_url_key='ge_price_api'):       
 
         
-    def dump_cache(self, path_override=None, backup_path=None):
-        if path_override:
-            path = pathlib.Path(path_override)
-        else:
-            path = self.cache_file
-        if backup_path:
-            backup_file(path, pathlib.Path(backup_path))
-        c = {k:v.price for k, v in self.cache.items()}
-        with open(path, 'w') as fp:
-            fp.write(f'{self.last_update}\n{json.dumps(c, indent=1)}')
-
-    def load_cache(self, path_override=None):
-        if path_override:
-            path = pathlib.Path(path_override)
-        else:
-            path = self.cache_file
+    def _load_json_cache(self, path):
         with open(path) as fp:
             last_update, b, c = fp.read().partition('\n')
         last_update = int(last_update)
@@ -469,28 +1362,51 @@ class GeInterface(_Interface,
             error = Exception('cache file is out of date')
             warnings.warn(error)
         self.last_update = last_update
-        c = {int(i):v for i, v in json.loads(c).items()}
         info = self._info_class
-        self.cache.update({i:info(**{'id':i, 'price':v, 'time':last_update})
-                           for i, v in c.items()})
+        c = {int(i):info(id=int(i), price=v, time=last_update)
+             for i, v in json.loads(c).items()}
+        self.cache.restore(c.values())
+        return c
+
+    def _loaded(self, infos):
+        if infos:
+            self.last_update = max(self.last_update, *(i.time for i in infos))
         
-    def _lookup(self, id):
-        check = time_in_seconds()
-        if id in self.cache and check - self.last_check < 300:
-            return self.cache[id]
+    def _lookup(self, id, priority=None):
         try:
-            self.requests.setdefault(check, 0)
-            self.requests[check] += 1
-            response = requests.get(self.price_url%id, timeout=2)
+            if priority is None:
+                item = get(id)
+                priority = item.ge_cache_priority if item else 0
+            response = TRANSPORT.get(self.price_url%id, timeout=2,
+                                     priority=priority)
             results = response.json()['daily']
             key = max(results)
         except Exception as error:
             return id, error
-        self.last_check = check
+        try:
+            HISTORY.merge(id, ((int(k)//1000, v) for k, v in results.items()))
+        except sqlite3.Error as error:
+            # the price itself is still good
+            warnings.warn(f'could not save the price history of {id}: {error}')
         return id, {'id':id, 'price':results[key], 'time':int(key)//1000}
 
-    def _auto_cache(self):
-        sorter = operator.attrgetter('ge_cache_priority')
+    def history(self, id, start=None, end=None, resolution=None):
+        """PriceSeries of `id` from the local history, which is first
+        brought up to date if its price isn't freshly cached"""
+        self.load_pending_cache()
+        id = int(id)
+        info, fresh = self.cache.lookup(id)
+        if not fresh or not HISTORY.get(id):
+            id, result = self._single_flight(id, self._fetch, id)
+            if isexceptioninstance(result) and not HISTORY.get(id):
+                raise result
+        return HISTORY.query(id, start, end, resolution)
+
+    def _schedule(self):
+        due = self.cache.due
+        return [(due(i.id), -i.ge_cache_priority, i.id) for i in list_items()]
+
+    def _refresh_interval(self):
         freq = 86400 / CONFIG.cache_settings.ge_auto_cache_frequency
         if freq < 6.5:
             error = ValueError("ge_auto_cache_frequency cannot be greater "
@@ -498,37 +1414,306 @@ class GeInterface(_Interface,
                                "(aka > ~90 lookups per 10 minutes) "
                                "without triggering Jagex's ddos protection.")
             raise error
-        while True:
-            update_reqs = self._get_most_recent_requests
-            cache = self.cache
-            self.requests = update_reqs(600)
-            past_10 = sum(self.requests.values())
-            n = min(20, max(0, 50-past_10))
-            if n:
-                pool = sorted(list_items(), key=sorter, reverse=True)
-                pool = (i for i in sorted(list_items(), key=sorter, reverse=1)
-                        if i.id not in cache)
-                result = self.lookup(*itertools.islice(pool, n))
-                errors = {k:v for k, v in result.items()
-                          if isinstance(v, Exception)}
-                if errors:
-                    self._exceptions[time_in_seconds()] = errors
-            sleep_time = freq * (n + max(past_10-20, 0))
-            time.sleep(sleep_time)            
-
-def load(__items=DotDict()):
-    global get, _search, _items, _by_name
+        return freq
+
+    def _refresh(self, id):
+        # lowest priority, so lookups people are waiting on go first. A
+        # flight of its own, or a lookup of `id` would join it and wait
+        # at that priority too.
+        id, result = self._single_flight(('refresh', id), self._fetch, id,
+                                         -sys.maxsize)
+        if isexceptioninstance(result):
+            raise result
+        return self.cache.due(id)
+
+class RefreshScheduler:
+    """Background thread refreshing an interface's cache entries as they
+    go stale, soonest due (then highest priority) first.
+
+    The queue is built once, and again only when the interface sees a
+    new price update. Refreshes are at least the interface's
+    `_refresh_interval()` seconds apart, and a key whose refresh failed
+    (or left it no fresher) is retried `retry_after` seconds later,
+    after calling on_error(key, exception) if it failed and it is given.
+    """
+
+    retry_after = 3600
+
+    def __init__(self, interface, *, on_error=None):
+        self.interface = interface
+        self.on_error = on_error
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                name=f'{self.interface.__class__.__name__} refresh')
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self.running and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        interface = self.interface
+        wait = self._stop.wait
+        queue = None
+        while not self._stop.is_set():
+            if queue is None or version != interface.last_update:
+                version = interface.last_update
+                queue = interface._schedule()
+                heapq.heapify(queue)
+            interval = interface._refresh_interval()
+            if not queue:
+                wait(interval)
+                queue = None
+                continue
+            due, priority, key = queue[0]
+            now = time_in_seconds()
+            if due > now:
+                wait(min(due-now, interval))
+                continue
+            heapq.heappop(queue)
+            try:
+                due = interface._refresh(key)
+            except Exception as error:
+                due = now + self.retry_after
+                if self.on_error is not None:
+                    self.on_error(key, error)
+            else:
+                if due <= now:
+                    # still stale (say a GE price that lags the latest
+                    # update), so let the rest of the queue go first
+                    due = now + self.retry_after
+            heapq.heappush(queue, (due, priority, key))
+            wait(interval)
+
+_is_loaded = False
+_load_lock = threading.RLock()
+
+def _ensure_loaded():
+    if not _is_loaded:
+        with _load_lock:
+            if not _is_loaded:
+                load()
+
+def get(id, default=None):
+    '''Item with id `id` or `default`
+
+    Until the database is loaded this loads it first; `load` then
+    replaces this with the lookup method of the loaded database.
+    '''
+    _ensure_loaded()
+    return _items.get(id, default)
+
+def warm():
+    '''Load the item database and any price caches that are set to be
+    loaded on import, if they have not been loaded yet'''
+    _ensure_loaded()
+    osb.load_pending_cache()
+    ge.load_pending_cache()
+
+def load(__items=DotDict(), *, columnar=False, snapshot=True):
+    '''(Re)load the item database and build the search engine
+
+    If `columnar` is True the items are kept in an ItemColumns store,
+    which uses a fraction of the memory of one Item object per item at
+    the cost of creating Items as they are looked up.
+
+    If `snapshot` is True, everything built here is read back from the
+    snapshot file next to the item database when it is newer than the
+    database and search files, and otherwise rebuilt and saved to it.
+    '''
+    global _is_loaded
+    with _load_lock:
+        _load(__items, columnar, snapshot)
+        _is_loaded = True
+
+def _search_priority(name):
+    # names added to the search since may not have an item
+    item = _by_name.get(name)
+    return item.ge_cache_priority if item is not None else 0
+
+def _load(__items, columnar, snapshot):
+    global get, _search, _items, _item_dict, _by_name, _completer
+    if '_search' in globals():
+        _search.cache_clear()
     __items.clear()
-    _items = MappingProxyType(__items)
+    _item_dict = __items
+    saved = load_snapshot(columnar) if snapshot else None
+    if saved:
+        abbv = saved['abbreviations']
+        state = saved['search']
+        _completer = saved['completer']
+        if columnar:
+            _items = saved['items']
+            _by_name = _items.by_name
+        else:
+            __items.update(saved['items'])
+            _items = MappingProxyType(__items)
+            _by_name = saved['by_name']
+    else:
+        ensure_data_files()
+        with open(PATH/CONFIG.filenames.item_data) as fp:
+            records = json.load(fp)
+        if columnar:
+            _items = ItemColumns(records)
+            _by_name = _items.by_name
+        else:
+            for line in records:
+                __items[line['id']] = Item(**line)
+            _items = MappingProxyType(__items)
+            _by_name = DotDict({i.name.lower(): i for i in _items.values()})
+        del records
+        abbv, ngrams, slang = get_search_setup()
+        state = dict(ngrams=ngrams, slang=slang)
     get = _items.get
-    with open(PATH/CONFIG.filenames.item_data) as fp:
-        for line in json.load(fp):
-            __items[line['id']] = Item(**line)
     _search = search_setup(map(name_getter, _items.values()),
-                           *get_search_setup(),
-                           result_cls=ItemSet)
-    _by_name = DotDict({i.name.lower(): i for i in _items.values()})
-    
+                           abbv, state.get('ngrams'), state.get('slang'),
+                           result_cls=ItemSet,
+                           priority=_search_priority,
+                           state=state if saved else None)
+    if saved:
+        return
+    # ids rather than Items, which ItemColumns would keep alive
+    ids = {name: item.id for name, item in _by_name.items()}
+    _completer = Completer([*ids.items(),
+                            *((k.lower(), ids[v.lower()]) for k, v in abbv.items()
+                              if v.lower() in ids)])
+    if snapshot:
+        save_snapshot(dict(columnar=columnar,
+                           items=_items if columnar else __items,
+                           by_name=None if columnar else _by_name,
+                           abbreviations=abbv,
+                           search=_search.state,
+                           completer=_completer))
+
+def _snapshot_sources():
+    names = map(CONFIG.filenames.__getitem__,
+                ('item_data', 'abbreviations', 'ngrams', 'slang'))
+    return {name:(stat.st_mtime_ns, stat.st_size)
+            for name, stat in ((i, (PATH/i).stat()) for i in names)}
+
+def snapshot_path(columnar=False):
+    kind = 'columns' if columnar else 'items'
+    return PATH/f'{CONFIG.filenames.item_data}.{kind}.snapshot'
+
+def load_snapshot(columnar=False):
+    '''Contents of the snapshot saved by `load`, or None if it is
+    missing, unreadable, from another version or older than its sources
+
+    The snapshot is a plain pickle, so this still recreates every
+    object in it; what it saves is parsing the JSON files and building
+    the name lookup and search index again.
+    '''
+    try:
+        with open(snapshot_path(columnar), 'rb') as fp:
+            saved = pickle.load(fp)
+        if (saved['version'] != SNAPSHOT_VERSION
+            or saved['sources'] != _snapshot_sources()
+            or saved['columnar'] != columnar):
+            return None
+    except Exception:
+        return None
+    return saved
+
+def save_snapshot(contents):
+    '''Atomically replace the snapshot file with `contents`'''
+    path = snapshot_path(contents['columnar'])
+    temp = path.with_name(f'{path.name}.tmp')
+    contents = dict(contents, version=SNAPSHOT_VERSION,
+                    sources=_snapshot_sources())
+    try:
+        with open(temp, 'wb') as fp:
+            pickle.dump(contents, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except OSError as error:
+        warnings.warn(f'could not save snapshot {path}: {error}')
+
+def shared_path():
+    '''Where `share` writes the catalogue by default'''
+    return PATH/f'{CONFIG.filenames.item_data}.shared'
+
+def _prices_path(path):
+    return path.with_name(f'{path.name}.prices')
+
+def share(path=None):
+    '''Write the loaded catalogue, search state and completions to a
+    file that worker processes can `attach` to, along with a
+    SharedPriceTable that the price caches of this process keep up to
+    date from then on.
+
+    Call it in the one process that refreshes prices (see auto_cache)
+    before starting the workers. Returns the path of the catalogue.
+    '''
+    _ensure_loaded()
+    path = pathlib.Path(path) if path else shared_path()
+    with _load_lock:
+        if isinstance(_items, ItemColumns):
+            columns = _items
+        else:
+            columns = ItemColumns(map(attr.asdict, _items.values()))
+        with open(PATH/CONFIG.filenames.abbreviations) as fp:
+            abbv = json.load(fp)
+        extra = pickle.dumps(dict(abbreviations=abbv,
+                                  search=_search.state,
+                                  completer=_completer),
+                             pickle.HIGHEST_PROTOCOL)
+        temp = path.with_name(f'{path.name}.tmp')
+        with open(temp, 'wb') as fp:
+            columns.dump(fp, extra)
+        os.replace(temp, path)
+        table = SharedPriceTable.create(_prices_path(path), columns)
+    osb.cache.share(table, 'osb', osb_info)
+    ge.cache.share(table, 'ge', ge_info)
+    return path
+
+def attach(path=None):
+    '''Use the catalogue and prices that `share` wrote in another process
+    instead of loading them
+
+    The items are read from the catalogue file mapped into memory, so
+    every process attached to it shares one copy, and prices cached by
+    the sharing process are used before any are looked up here. Only
+    the search state is unpickled in each process.
+
+    Attaching is only cheap if load_items_on_import is false in the
+    config of the attaching processes, as otherwise importing this
+    module has already loaded everything.
+    '''
+    global get, _search, _items, _item_dict, _by_name, _completer, _is_loaded
+    path = pathlib.Path(path) if path else shared_path()
+    with open(path, 'rb') as fp:
+        columns = SharedItemColumns(
+            mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+    saved = pickle.loads(columns.extra)
+    table = SharedPriceTable.open(_prices_path(path))
+    with _load_lock:
+        if '_search' in globals():
+            _search.cache_clear()
+        _item_dict = DotDict()
+        _items = columns
+        _by_name = columns.by_name
+        get = columns.get
+        state = saved['search']
+        _search = search_setup((), saved['abbreviations'],
+                               state.get('ngrams'), state.get('slang'),
+                               result_cls=ItemSet,
+                               priority=_search_priority,
+                               state=state)
+        _completer = saved['completer']
+        _is_loaded = True
+    osb.cache.share(table, 'osb', osb_info)
+    ge.cache.share(table, 'ge', ge_info)
+
 def get_search_setup():
     'abbv, ngrams, slang'
     with open(PATH/CONFIG.filenames.abbreviations) as fp:
@@ -541,12 +1726,15 @@ def get_search_setup():
 
 
 def view_items():
+    _ensure_loaded()
     return ItemSet._from_itemset(_items.values())
 
 def list_items():
+    _ensure_loaded()
     return List(_items.values())
 
 def iter_items():
+    _ensure_loaded()
     return iter( _items.values())
 
 def save_itemdb(path_override=None, backup=None):
@@ -562,53 +1750,146 @@ def save_itemdb(path_override=None, backup=None):
         path = pathlib.Path(path_override)
     else:
         path = PATH/CONFIG.filenames.item_data
-    items = map(operator.methodcaller('_dump'), iter_items())
-    text = json.dumps([*items], indent=2)
-    json.loads(text)
+    items = [attr.asdict(i) for i in iter_items()]
     if backup:
         backup_file(path, pathlib.Path(backup))
-        backup = pathlib.Path(backup)
-    with open(path, 'w') as fp:
-        fp.write(text)
-
-def update_itemdb():
-    '''Check for new items added to the game and add them to the DB'''
-    response = requests.get(CONFIG.item_data_urls['osb_catalogue'])
-    data = response.json()
-    data = {int(k):v for k, v in data.items() if k not in OSB_IGNORE}
-    missing = [i for i in data if not get(i)]
-    new = {k:{'id':k,
-              'name':v['name'],
-              'alch':v['sp']*2//3,
-              'membs':v['members']} for k, v in data.items()
-           if k in missing}
-    
+    _write_json(path, items)
+
+def _write_json(path, obj):
+    temp = path.with_name(f'{path.name}.tmp')
+    with open(temp, 'w') as fp:
+        json.dump(obj, fp, indent=2)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(temp, path)
+
+def _add_items(new):
+    '''Write the new Items to the item DB and add them to the loaded
+    items, search and completions'''
+    global _completer
+    path = PATH/CONFIG.filenames.item_data
+    with _load_lock, open(path) as fp:
+        records = json.load(fp)
+        records += [attr.asdict(i) for i in new if not get(i.id)]
+        _write_json(path, records)
+        if isinstance(_items, ItemColumns):
+            # the columns can't grow, so build them again from the file
+            _load(DotDict(), True, False)
+            return
+        for item in new:
+            _item_dict[item.id] = item
+            _by_name[item.name.lower()] = item
+        _search.add(*map(name_getter, new))
+        _completer = Completer([*zip(_completer.keys, _completer.targets),
+                                *((i.name.lower(), i.id) for i in new)])
+
+def update_queue_path():
+    return PATH/f'{CONFIG.filenames.item_data}.update.json'
+
+def update_itemdb(*, workers=8, max_attempts=3, progress=None,
+                  batch_size=25, retry_failed=False):
+    '''Check for new items added to the game and add them to the DB
+
+    The ids still to be added are kept in a work queue file next to the
+    item DB, so an interrupted update carries on where it stopped. Their
+    descriptions are downloaded by `workers` threads and each id gets
+    `max_attempts` tries, after which it's set aside as failed (and only
+    tried again with `retry_failed`). Every `batch_size` finished items
+    are written to the DB and added to the loaded items and search.
+
+    progress(added, failed, total) is called after each id is done with.
+    Returns an ItemSet of the items added.
+    '''
+    _ensure_loaded()
+    queue_path = update_queue_path()
+    if queue_path.exists():
+        with open(queue_path) as fp:
+            queue = json.load(fp)
+    else:
+        queue = {'pending':{}, 'failed':{}}
+    pending = {int(k):v for k, v in queue['pending'].items()}
+    failed = {int(k):v for k, v in queue['failed'].items()}
+    if retry_failed:
+        for v in failed.values():
+            v['attempts'] = 0
+        pending.update(failed)
+        failed.clear()
+    for id, entry in osb.catalogue_entries().items():
+        if id not in pending and id not in failed and not get(id):
+            pending[id] = {'name':entry.name,
+                           'alch':entry.store_price*2//3,
+                           'membs':entry.members,
+                           'attempts':0}
+    pending = {k:v for k, v in pending.items() if not get(k)}
+    total = len(pending)
+    added = []
+    batch = []
+    todo = deque(pending)
+
+    def save_queue():
+        if pending or failed:
+            _write_json(queue_path, {'pending':pending, 'failed':failed})
+        elif queue_path.exists():
+            queue_path.unlink()
+
+    def flush():
+        if batch:
+            _add_items(batch)
+            added.extend(batch)
+            batch.clear()
+        save_queue()
+
     def desc_getter(id):
         try:
-            response = requests.get(CONFIG.item_data_urls['ge_catalogue']%id)
-            j = response.json()
-            desc = j['item']['description']
-            return id, desc
-        except:
-            return None, None
-    while missing:
-        chunk = missing[:30]
-        with ThreadPoolExecutor(len(chunk)) as executor:
-            futures = map(executor.submit, itertools.repeat(desc_getter), chunk)
-            for future in as_completed(futures):
-                itemid, desc = future.result()
-                if isinstance(desc, str):
-                    new[itemid]['desc'] = desc
-                    missing.remove(itemid)
-    for k, v in new.items():
-        if k in _items:
-            raise ValueError('there already is an item with id {id}')
-        _items[k] = Item(**v)
+            j = TRANSPORT.get_json(CONFIG.item_data_urls['ge_catalogue']%id)
+            return id, j['item']['description']
+        except Exception as error:
+            return id, error
+
+    with ThreadPoolExecutor(workers) as executor:
+        running = set()
+        while todo or running:
+            # never more than twice the workers queued up at once
+            while todo and len(running) < 2*workers:
+                running.add(executor.submit(desc_getter, todo.popleft()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                id, desc = future.result()
+                entry = pending[id]
+                if isstrinstance(desc):
+                    del pending[id]
+                    batch.append(Item(id=id, name=entry['name'], desc=desc,
+                                      alch=entry['alch'], membs=entry['membs']))
+                else:
+                    entry['attempts'] += 1
+                    if entry['attempts'] < max_attempts:
+                        todo.append(id)
+                    else:
+                        failed[id] = pending.pop(id)
+                        warnings.warn(f'could not get the description of '
+                                      f'item {id}: {desc!r}')
+                if len(batch) >= batch_size:
+                    flush()
+                if progress is not None:
+                    progress(len(added)+len(batch), len(failed), total)
+    flush()
+    return ItemSet._from_itemset(added)
         
 def get_by_name(name, default=None):
+    _ensure_loaded()
     return _by_name.get(' '.join(name.lower().split()), default)
 
-def search(*params):
+def complete(prefix, limit=10):
+    '''Items whose names (or abbreviations) start with `prefix`
+
+    Returns an ItemSet of up to `limit` items in alphabetical order of
+    the name or abbreviation that matched.
+    '''
+    _ensure_loaded()
+    ids = _completer.complete(prefix.lower(), limit)
+    return ItemSet._from_itemset([*map(get, ids)])
+
+def search(*params, fuzzy=False, limit=5):
     '''Search the item database
 
     Parameters can be integers representing item id number or strings.
@@ -617,7 +1898,11 @@ def search(*params):
     are correctly resolved. "blk ele" for example will find
     "Black elegant shirt" and "Black elegant legs" and "rune ore"
     will match "Runite ore".
+
+    If `fuzzy` is True, each string instead finds the `limit` items
+    whose names are the fewest typos away from it.
     '''
+    _ensure_loaded()
     result = ItemSet()
     from_ids = []
     for param in params:
@@ -630,7 +1915,7 @@ def search(*params):
         elif isstrinstance(param):
             if not param:
                 raise ValueError('cannot search for empty string')
-            items = _search(param)
+            items = _search(param, fuzzy=fuzzy, limit=limit)
             if items:
                 result |= items
         else:
@@ -638,14 +1923,60 @@ def search(*params):
             raise error
     return result | ItemSet(*from_ids)
 
-load()
+def search_many(queries):
+    '''Search the item database for many queries at once
+
+    Each query can be anything `search` accepts as a single parameter.
+    Returns a list holding one ItemSet per query, in the same order.
+    Repeated strings, or strings that only differ in case and slang,
+    are only searched once.
+    '''
+    _ensure_loaded()
+    queries = [*queries]
+    strs = []
+    for param in queries:
+        if isstrinstance(param):
+            if not param:
+                raise ValueError('cannot search for empty string')
+            strs += [param]
+        elif not isintinstance(param):
+            error = TypeError('search parameters must be ints or strs.')
+            raise error
+    found = dict(zip(strs, _search.search_many(strs)))
+    results = []
+    for param in queries:
+        if isintinstance(param):
+            item = get(param)
+            if item is None:
+                error = ValueError(f'{param} is not a valid item id.')
+                raise error
+            results += [ItemSet(item)]
+        else:
+            results += [found[param] or ItemSet()]
+    return results
+
 cls=GeInterface
 ge = cls()
 osb=OSBInterface()
 ge_lookup = GeInterface().lookup
 osb_lookup = OSBInterface().lookup
-if CONFIG.general_settings.load_osb_cache_on_import:
-    osb.load_cache()
-if CONFIG.general_settings.load_ge_cache_on_import:
-    ge.load_cache()
+# Jagex throttles by IP, so every request to the GE host (prices, item
+# details, hiscores) shares one budget: ge_auto_cache_frequency lookups a
+# day with bursts of up to GE_BURST, across processes where possible
+GE_BURST = 50
+# every GE price point downloaded, kept for price_history
+HISTORY = PriceHistory(PATH/'ge_history.sqlite3')
+GE_LIMITER = RateLimiter(CONFIG.cache_settings.ge_auto_cache_frequency/86400,
+                         GE_BURST, path=PATH/'ge_rate_limit')
+TRANSPORT.limit(urlsplit(CONFIG.item_data_urls.ge_price_api).netloc,
+                GE_LIMITER)
+osb._cache_pending = CONFIG.general_settings.load_osb_cache_on_import
+ge._cache_pending = CONFIG.general_settings.load_ge_cache_on_import
+# otherwise everything is loaded on first use
+if CONFIG.general_settings.load_items_on_import:
+    warm()
+if CONFIG.general_settings.osb_autocache:
+    osb.auto_cache()
+if CONFIG.general_settings.ge_autocache:
+    ge.auto_cache()
     
@@ -0,0 +1,179 @@
+"""Price service: one process owning the item database, the price
+interfaces, their caches and the request budget, shared by any number
+of local clients over HTTP.
+
+    python -m ohseven.serve [--host HOST] [--port PORT] [--auto-cache]
+
+Clients POST a JSON call, {"method": name, "params": [...], "kwargs":
+{...}}, or a list of calls, to /rpc and get back {"result": ...} or
+{"error": {"type": ..., "message": ...}} for each. Connections are kept
+alive between calls. client.Client wraps all of this in the items API.
+"""
+import argparse
+import json
+import signal
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import attr
+from publicize import public
+
+try:
+    from . import items
+    from .client import DEFAULT_HOST, DEFAULT_PORT
+    from .utils import isexceptioninstance
+except ImportError:
+    import items
+    from client import DEFAULT_HOST, DEFAULT_PORT
+    from utils import isexceptioninstance
+
+# largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 2**20
+
+def _item(item):
+    return None if item is None else attr.asdict(item)
+
+def _itemset(itemset):
+    return [*map(attr.asdict, itemset)]
+
+def _error(error):
+    return {'error': {'type': error.__class__.__name__,
+                      'message': str(error)}}
+
+def _prices(results):
+    return {id:_error(info) if isexceptioninstance(info) else info._asdict()
+            for id, info in results.items()}
+
+def _cache_info():
+    return {'ge': items.ge.cache_info()._asdict(),
+            'osb': items.osb.cache_info()._asdict()}
+
+METHODS = {
+    'get': lambda id: _item(items.get(id)),
+    'get_by_name': lambda name: _item(items.get_by_name(name)),
+    'search': lambda *params, **kwargs: _itemset(items.search(*params, **kwargs)),
+    'search_many': lambda queries: [*map(_itemset, items.search_many(queries))],
+    'complete': lambda prefix, limit=10: _itemset(items.complete(prefix, limit)),
+    'ge_lookup': lambda *ids: _prices(items.ge_lookup(*ids)),
+    'osb_lookup': lambda *ids: _prices(items.osb_lookup(*ids)),
+    'cache_info': _cache_info,
+    }
+
+@public
+def call(request):
+    """{"result": ...} of one call, or {"error": ...} if it failed"""
+    try:
+        method = METHODS.get(request['method'])
+        if method is None:
+            error = ValueError(f'no method {request["method"]!r}')
+            raise error
+        return {'result': method(*request.get('params', ()),
+                                 **request.get('kwargs', {}))}
+    except Exception as error:
+        return _error(error)
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that connections are kept alive
+    protocol_version = 'HTTP/1.1'
+    # the headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != '/rpc':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_SIZE:
+            self.send_error(413)
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400, 'body is not JSON')
+            return
+        if isinstance(body, list):
+            response = [*map(call, body)]
+        elif isinstance(body, dict):
+            response = call(body)
+        else:
+            self.send_error(400, 'body is not a call or a list of calls')
+            return
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+@public
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, *, verbose=False):
+    """An HTTP server for the items API, not yet serving"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+def dump_caches():
+    for interface in (items.ge, items.osb):
+        try:
+            interface.dump_cache()
+        except OSError as error:
+            warnings.warn(f'could not write the {interface.__class__.__name__} cache: {error}')
+
+@public
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, *, auto_cache=False,
+          dump_interval=60, verbose=False):
+    '''Serve the items API on http://host:port/rpc until interrupted
+
+    The price caches are written out every `dump_interval` seconds and
+    on the way out. With `auto_cache` they are also kept warm in the
+    background, so clients are mostly answered from the cache.
+    '''
+    items.warm()
+    if auto_cache:
+        items.osb.auto_cache()
+        items.ge.auto_cache()
+    server = make_server(host, port, verbose=verbose)
+    stop = threading.Event()
+    def dump():
+        while not stop.wait(dump_interval):
+            dump_caches()
+    threading.Thread(target=dump, name='ohseven-dump', daemon=True).start()
+    if threading.current_thread() is threading.main_thread():
+        # shut down cleanly when stopped by a service manager too
+        signal.signal(signal.SIGTERM, lambda signum, frame:
+                      threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        items.osb.stop_auto_cache()
+        items.ge.stop_auto_cache()
+        dump_caches()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ohseven.serve',
+        description='Serve the ohseven items API to local clients.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--auto-cache', action='store_true',
+                        help='keep the price caches warm in the background')
+    parser.add_argument('--dump-interval', type=float, default=60,
+                        help='seconds between writing out the price caches')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, auto_cache=args.auto_cache,
+          dump_interval=args.dump_interval, verbose=args.verbose)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+
+def _import_items():
+    # items loads ~/.ohseven.data/config.json when it's imported, so give
+    # it a home of its own where nothing is loaded until it's asked for
+    home = Path(tempfile.mkdtemp())
+    (home/'.ohseven.data').mkdir()
+    with open(HERE/'.ohseven.data'/'config.json') as fp:
+        config = json.load(fp)
+    config['general_settings'].update(load_items_on_import=False,
+                                      load_ge_cache_on_import=False,
+                                      load_osb_cache_on_import=False)
+    with open(home/'.ohseven.data'/'config.json', 'w') as fp:
+        json.dump(config, fp)
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = str(home)
+    # the modules import each other relatively, so items has to be
+    # imported as part of the package this directory is
+    sys.path.insert(0, str(HERE.parent))
+    try:
+        return importlib.import_module(f'{HERE.name}.items')
+    finally:
+        sys.path.remove(str(HERE.parent))
+        if old_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = old_home
+
+items = _import_items()
+
+def info(id, price, time):
+    return items.ge_info(id=id, price=price, time=time)
+
+@pytest.fixture(params=['log', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'log':
+        return items.LogCacheStore(tmp_path/'cache.log')
+    return items.SQLiteCacheStore(tmp_path/'cache.sqlite3')
+
+def test_store_round_trip(store):
+    store.compact({1: info(1, 100, 10), 2: info(2, 200, 20)})
+    store.write({2: None, 3: info(3, 300, 30), 1: info(1, 150, 40)},
+                lambda: {})
+    assert store.load() == {1: (150, 40), 3: (300, 30)}
+    assert store.__class__(store.path).load() == {1: (150, 40), 3: (300, 30)}
+    store.compact({4: info(4, 1.5, 50)})
+    assert store.load() == {4: (1.5, 50)}
+
+def test_cache_store_is_abstract():
+    with pytest.raises(TypeError):
+        items.CacheStore('cache')
+
+def test_log_store_skips_a_torn_line_without_writing(tmp_path):
+    path = tmp_path/'cache.log'
+    path.write_bytes(b'1 100 10\n2 200 20\n3 30')
+    store = items.LogCacheStore(path)
+    assert store.load() == {1: (100, 10), 2: (200, 20)}
+    assert path.read_bytes() == b'1 100 10\n2 200 20\n3 30'
+    store.write({4: info(4, 400, 40)}, lambda: {})
+    assert path.read_bytes() == b'1 100 10\n2 200 20\n4 400 40\n'
+
+def test_loading_a_json_cache_leaves_it_alone(tmp_path):
+    now = int(time.time())
+    path = tmp_path/'ge_cache.json'
+    path.write_text(f'{now}\n{{"2": 5, "6": 7}}')
+    contents = path.read_bytes()
+    items.ge.load_cache(path)
+    assert path.read_bytes() == contents
+    assert items.ge.cache[2] == info(2, 5, now)
+    assert items.ge.cache[6] == info(6, 7, now)
@@ -0,0 +1,111 @@
+import json
+import random
+from heapq import nsmallest
+from pathlib import Path
+
+import pytest
+
+try:
+    from .search_engine import NgramIndex, search_setup
+except ImportError:
+    from search_engine import NgramIndex, search_setup
+
+DATA = Path(__file__).resolve().parent/'.ohseven.data'
+
+def _rules(name):
+    with open(DATA/f'{name}.json') as fp:
+        return json.load(fp)
+
+ABBREVIATIONS = _rules('abbreviations')
+NGRAMS = _rules('ngrams')
+SLANG = _rules('slang')
+
+NAMES = sorted({*ABBREVIATIONS.values(), *(
+    f'{kind} potion({dose})' for kind in ('Attack', 'Super attack',
+                                          'Prayer', 'Ranging', 'Antifire',
+                                          'Super restore')
+                             for dose in range(1, 5)),
+    'Rune platebody', 'Rune platelegs', 'Rune plateskirt', 'Rune scimitar',
+    'Adamant platebody', 'Mithril scimitar', 'Dragon scimitar',
+    'Dragon dagger', 'Dragon dagger(p++)', 'Bronze arrow', 'Iron arrow',
+    'Rune arrow', 'Bat bones', 'Acrobat boots', 'Yew logs', 'Magic logs',
+    'Mystic robe top (dark)', 'Mystic robe bottom (dark)',
+    'Antipoison(4)', 'Antidote++(4)', 'Cannonball', 'Nature rune',
+    })
+
+def _queries(names):
+    random.seed(1)
+    queries = {*ABBREVIATIONS, 'p pot 4', 'anti++', 'black myst robe',
+               'super att 2', 'rune  pl', 'a a', '  ', 'ru~ne', '~'}
+    for name in map(str.lower, names):
+        words = name.split(' ')
+        queries.update((name, words[0], words[-1],
+                        name[:random.randint(1, len(name))],
+                        ' '.join(random.sample(words, len(words))),
+                        ' '.join(w[:random.randint(1, len(w))] for w in words)))
+    for _ in range(300):
+        queries.add(''.join(random.choice('abdeilmnoprst +()2')
+                            for _ in range(random.randint(1, 8))))
+    return sorted(queries)
+
+def _found(search, query):
+    try:
+        result = search(query)
+    except Exception as error:
+        return error.__class__
+    return result if result is None else sorted(result.all)
+
+def _setup(names, engine):
+    return search_setup(names, ABBREVIATIONS, NGRAMS, SLANG, engine=engine)
+
+def test_index_engine_finds_what_scan_does():
+    scan, index = _setup(NAMES, 'scan'), _setup(NAMES, 'index')
+    for query in _queries(NAMES):
+        assert _found(index, query) == _found(scan, query), query
+
+@pytest.mark.parametrize('engine', ['scan', 'index'])
+def test_add_and_remove_match_a_fresh_setup(engine):
+    first, added, removed = NAMES[::2], NAMES[1::2], NAMES[::6]
+    queries = _queries(NAMES)
+    search = _setup(first, engine)
+    fuzzy = lambda search: lambda q: search(q, fuzzy=True, limit=len(NAMES))
+    # cache results from before the change, which must not be served
+    for query in queries:
+        _found(search, query)
+        _found(fuzzy(search), query)
+    search.add(*added)
+    search.remove(*removed)
+    expected = _setup([n for n in first + added if n not in removed], engine)
+    for query in queries:
+        assert _found(search, query) == _found(expected, query), query
+        # every fuzzy hit, as ties are broken by position
+        assert (_found(fuzzy(search), query)
+                == _found(fuzzy(expected), query)), query
+
+def _levenshtein(a, b):
+    row = range(len(b)+1)
+    for i, x in enumerate(a, 1):
+        previous, row = row, [i]
+        for j, y in enumerate(b, 1):
+            row.append(min(previous[j]+1, row[j-1]+1, previous[j-1]+(x != y)))
+    return row[-1]
+
+@pytest.mark.parametrize('max_distance', [1, 2, 3])
+def test_nearest_matches_brute_force(max_distance):
+    names = [*map(str.lower, NAMES)]
+    index = NgramIndex(names)
+    index.remove(names.index('rune arrow'))
+    live = [(pos, name) for pos, name in enumerate(index.names) if name]
+    random.seed(2)
+    queries = ['', 'a', 'ab', 'rune arrow', 'rune arow', 'dragn dager']
+    for _ in range(200):
+        name = random.choice(names)
+        for _ in range(random.randint(0, max_distance+1)):
+            i = random.randrange(len(name)+1)
+            name = name[:i] + random.choice('abeor ') + name[i+1:]
+        queries.append(name)
+    for query in queries:
+        expected = nsmallest(5, ((d, pos, name) for pos, name in live
+                                 for d in [_levenshtein(query, name)]
+                                 if d <= max_distance))
+        assert index.nearest(query, 5, max_distance) == expected, query
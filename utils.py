@@ -1,9 +1,21 @@
 
+import codecs
+import heapq
+import json
+import os
+import random
+import threading
 import time
-from operator import attrgetter, itemgetter, methodcaller
-from collections import OrderedDict as odict, deque, namedtuple
+import warnings
+from operator import attrgetter
+from collections import OrderedDict as odict
 from itertools import *
+from urllib.parse import urlsplit
 from publicize import public, public_constants
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 class Sentinel:
     
@@ -87,3 +99,272 @@ def backup_file(old_path, backup_path):
     with open(old_path, 'rb') as fpin, open(backup_path, 'wb') as fpout:
         fpout.write(fpin.read())
         
+
+@public
+def iter_json_object(chunks):
+    """Yield the (key, value) pairs of the JSON object whose text (or
+    utf-8 bytes) is split across `chunks`, each as soon as it's been
+    read, so the whole document never has to be in memory at once."""
+    decode = json.JSONDecoder().raw_decode
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            chunk = decoder.decode(b'', final=True)
+        elif not isstrinstance(chunk):
+            chunk = decoder.decode(chunk)
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            more()
+
+    def expect(chars):
+        nonlocal pos
+        skip_space()
+        if pos >= len(buf) or buf[pos] not in chars:
+            error = ValueError(f'expected one of {chars!r} at {pos} of {buf[pos:pos+20]!r}')
+            raise error
+        pos += 1
+        return buf[pos-1]
+
+    def value():
+        nonlocal pos
+        skip_space()
+        while True:
+            try:
+                result, end = decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more()
+                continue
+            # a number could still go on in the next chunk
+            if end == len(buf) and not eof:
+                more()
+                continue
+            pos = end
+            return result
+
+    expect('{')
+    skip_space()
+    if buf[pos:pos+1] == '}':
+        return
+    while True:
+        key = value()
+        expect(':')
+        yield key, value()
+        if expect(',}') == '}':
+            return
+
+@public
+class RateLimiter:
+    """Token bucket letting `rate` calls a second through on average and
+    at most `burst` at once.
+
+    Blocked callers get through highest `priority` first (then first
+    come, first served). With a `path` the bucket is kept in that file
+    under an exclusive lock, so every process using the same file shares
+    the budget; priorities are only compared within a process."""
+
+    def __init__(self, rate, burst=1, *, path=None):
+        if rate <= 0 or burst < 1:
+            error = ValueError('rate must be positive and burst at least 1')
+            raise error
+        if path is not None and fcntl is None:
+            warnings.warn('file locks are not available on this platform, '
+                          'so the rate limit is not shared between processes')
+            path = None
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self._tokens = burst
+        self._stamp = time.time()
+        self._waiters = []
+        self._count = count()
+        self._cond = threading.Condition()
+
+    def _refill(self, tokens, stamp, now):
+        return min(self.burst, tokens + (now-stamp)*self.rate)
+
+    def _take(self):
+        """Take a token, returning 0, or the seconds until there is one"""
+        now = time.time()
+        if self.path is None:
+            tokens = self._tokens = self._refill(self._tokens, self._stamp, now)
+            self._stamp = now
+            if tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1-tokens) / self.rate
+        fd = os.open(self.path, os.O_RDWR|os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                tokens, stamp = map(float, os.read(fd, 64).split())
+            except ValueError:
+                tokens, stamp = self.burst, now
+            tokens = self._refill(tokens, stamp, now)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1-tokens) / self.rate
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, f'{tokens!r} {now!r}'.encode())
+            return wait
+        finally:
+            os.close(fd)
+
+    def acquire(self, priority=0, timeout=None):
+        """Wait for a token. False if `timeout` seconds pass first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiters = self._waiters
+        entry = [-priority, next(self._count)]
+        with self._cond:
+            heapq.heappush(waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if waiters[0] is entry:
+                        wait = self._take()
+                        if not wait:
+                            return True
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                waiters.remove(entry)
+                heapq.heapify(waiters)
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+@public
+class Transport:
+    """Pooled HTTP session shared by everything that downloads.
+
+    Connections are kept alive per host, at most `per_host` requests to
+    one host are in flight at once, and failed requests (connection
+    errors, timeouts and `retry_statuses`) are retried up to `retries`
+    times with full jitter exponential backoff, capped at `max_backoff`
+    seconds (or the server's Retry-After)."""
+
+    retry_statuses = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, *, retries=3, backoff=.1, max_backoff=10,
+                 per_host=16, timeout=10):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.per_host = per_host
+        self.timeout = timeout
+        self.limiters = {}
+        self._session = None
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limit(self, host, limiter):
+        """Make every request (and retry) to `host` wait on `limiter`"""
+        self.limiters[host] = limiter
+
+    @property
+    def session(self):
+        # requests is only imported once something has to be downloaded
+        session = self._session
+        if session is None:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    import requests
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.per_host,
+                        pool_maxsize=self.per_host)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return session
+
+    def _host_limit(self, host):
+        limit = self._hosts.get(host)
+        if limit is None:
+            with self._lock:
+                limit = self._hosts.setdefault(
+                    host, threading.BoundedSemaphore(self.per_host))
+        return limit
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` (from 0)"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(self.max_backoff, int(retry_after))
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2**attempt))
+
+    def get(self, url, *, retries=None, timeout=None, priority=0, **kwargs):
+        """requests.get(url) on the shared session, retried on failure.
+
+        Returns the last response when the retries run out on a bad
+        status, and raises the last exception when they run out on a
+        connection error or timeout. If the host is rate limited, higher
+        `priority` requests get through first."""
+        from requests import ConnectionError, Timeout
+        session = self.session
+        retries = self.retries if retries is None else retries
+        timeout = self.timeout if timeout is None else timeout
+        host = urlsplit(url).netloc
+        limit = self._host_limit(host)
+        limiter = self.limiters.get(host)
+        attempt = 0
+        while True:
+            response = None
+            if limiter is not None:
+                limiter.acquire(priority)
+            with limit:
+                try:
+                    response = session.get(url, timeout=timeout, **kwargs)
+                except (ConnectionError, Timeout):
+                    if attempt >= retries:
+                        raise
+                else:
+                    if (response.status_code not in self.retry_statuses
+                        or attempt >= retries):
+                        return response
+                    # give the connection back to the pool, even if the
+                    # body was streamed and never read
+                    response.close()
+            time.sleep(self.delay(attempt, response))
+            attempt += 1
+
+    def get_json(self, url, **kwargs):
+        return self.get(url, **kwargs).json()
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None